@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import resource
+import time
+from collections import defaultdict
+
+import pdfplumber
+
+import pdf_reader
+
+# Directory holding the benchmark PDFs and golden.json, the committed corpus
+# is written by benchmark_corpus/make_corpus.py
+corpus_dir = "benchmark_corpus"
+
+# Stages of extract_pdf_fields() timed separately
+stages = [
+    "split_pdf_and_extract_text_portrait",
+    "split_pdf_and_extract_text_landscape",
+    "check_totalrevision",
+    "split_totalrevision",
+    "extract_primary_norms",
+    "extract_secondary_norms",
+    "extract_annex_norms",
+]
+
+
+def instrument(timings):
+    # Wrap the stages in pdf_reader so extract_pdf_fields() reports their time
+    originals = {name: getattr(pdf_reader, name) for name in stages}
+
+    def timed(name):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return originals[name](*args, **kwargs)
+            finally:
+                timings[name] += time.perf_counter() - start
+
+        return wrapper
+
+    for name in stages:
+        setattr(pdf_reader, name, timed(name))
+    return originals
+
+
+def restore(originals):
+    for name, function in originals.items():
+        setattr(pdf_reader, name, function)
+
+
+def pdf_case(fields, landscape):
+    if landscape:
+        return "landscape"
+    if fields.get("Totalrevision"):
+        return "totalrevision"
+    return "portrait"
+
+
+def norm_set(norms):
+    # Secondary norms are either a list or a mapping of law name to norms
+    if isinstance(norms, dict):
+        return {
+            (law, norm)
+            for law, law_norms in norms.items()
+            if isinstance(law_norms, list)
+            for norm in law_norms
+        }
+    return {(None, norm) for norm in norms}
+
+
+def load_golden(directory):
+    try:
+        with open(os.path.join(directory, "golden.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_golden(directory, golden):
+    with open(os.path.join(directory, "golden.json"), "w", encoding="utf-8") as f:
+        json.dump(golden, f, indent=4, ensure_ascii=False, sort_keys=True)
+
+
+def run(directory, repeat=1):
+    """Extract every PDF of the corpus and collect timings and results."""
+    timings = defaultdict(float)
+    results = {}
+    cases = {}
+    pages = 0
+    total = 0.0
+
+    names = sorted(name for name in os.listdir(directory) if name.endswith(".pdf"))
+    originals = instrument(timings)
+    try:
+        for name in names:
+            path = os.path.join(directory, name)
+            with pdfplumber.open(path) as pdf:
+                pages += len(pdf.pages) * repeat
+                landscape = pdf.pages[0].width > pdf.pages[0].height
+            for _ in range(repeat):
+                start = time.perf_counter()
+                with open(path, "rb") as f:
+                    results[name] = pdf_reader.extract_pdf_fields(f)
+                total += time.perf_counter() - start
+            cases[name] = pdf_case(results[name], landscape)
+    finally:
+        restore(originals)
+
+    return {
+        "files": len(names),
+        "pages": pages,
+        "seconds": total,
+        "timings": dict(timings),
+        "results": results,
+        "cases": cases,
+    }
+
+
+def score(results, cases, golden):
+    # Micro-averaged precision and recall per norm field and case
+    counts = defaultdict(lambda: [0, 0, 0])  # true positives, extracted, expected
+    for name, expected in golden.items():
+        if name not in results:
+            continue
+        case = expected.get("case") or cases[name]
+        for field in ["primary_norms", "secondary_norms"]:
+            extracted = norm_set(results[name][field])
+            wanted = norm_set(expected[field])
+            for key in [(field, "all"), (field, case)]:
+                counts[key][0] += len(extracted & wanted)
+                counts[key][1] += len(extracted)
+                counts[key][2] += len(wanted)
+
+    scores = {}
+    for key, (hits, extracted, wanted) in sorted(counts.items()):
+        scores[key] = (
+            hits / extracted if extracted else 1.0,
+            hits / wanted if wanted else 1.0,
+        )
+    return scores
+
+
+def report(stats, scores):
+    seconds = stats["seconds"] or float("inf")
+    print(f"Files:          {stats['files']}")
+    print(f"Pages:          {stats['pages']}")
+    print(f"Total time:     {stats['seconds']:.2f} s")
+    print(f"Pages/second:   {stats['pages'] / seconds:.1f}")
+    # ru_maxrss is reported in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Peak RSS:       {peak:.1f} MB")
+
+    print("\nStage timings:")
+    staged = 0.0
+    for name in stages:
+        spent = stats["timings"].get(name, 0.0)
+        staged += spent
+        print(f"  {name:<38} {spent:8.2f} s")
+    print(f"  {'open and orientation check':<38} {stats['seconds'] - staged:8.2f} s")
+
+    if scores:
+        print("\nPrecision / recall against golden.json:")
+        for (field, case), (precision, recall) in scores.items():
+            print(f"  {field:<16} {case:<14} {precision:6.1%} {recall:6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the norm extraction on a corpus of stored PDFs."
+    )
+    parser.add_argument("directory", nargs="?", default=corpus_dir)
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="extract every PDF this many times"
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="add the current output of PDFs without golden norms to golden.json "
+        "as a baseline, review it by hand before committing",
+    )
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        parser.error(
+            f"corpus directory {args.directory!r} not found, run "
+            "benchmark_corpus/make_corpus.py or copy PDFs from pdf_cache/"
+        )
+
+    stats = run(args.directory, args.repeat)
+    golden = load_golden(args.directory)
+
+    if args.record:
+        for name, fields in stats["results"].items():
+            golden.setdefault(
+                name,
+                {
+                    "case": stats["cases"][name],
+                    "primary_norms": fields["primary_norms"],
+                    "secondary_norms": fields["secondary_norms"],
+                },
+            )
+        save_golden(args.directory, golden)
+
+    report(stats, score(stats["results"], stats["cases"], golden))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Write the synthetic benchmark corpus and its golden.json.
+
+The PDFs reproduce the layouts extract_pdf_fields() handles: a portrait
+Vorlage with Nebenerlasse, a landscape Synopse and a Totalrevision with an
+Anhang. Their text is given below, the golden norms next to it were
+written by hand from that text and not from the output of the extraction.
+
+Needs reportlab, which is not part of requirements.txt:
+
+    pip install reportlab
+    python3 benchmark_corpus/make_corpus.py
+"""
+
+import json
+import os
+
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.pdfgen import canvas
+
+corpus_dir = os.path.dirname(os.path.abspath(__file__))
+
+font_size = 10
+line_height = 12
+# Vertical space between two text blocks, well above the split threshold
+block_gap = 24
+# First line of the body, below the header cropped by body_bounds()
+body_top = 90
+
+# A page is a list of text blocks, a block a list of lines
+portrait_pages = [
+    [
+        ["Antrag des Regierungsrates vom 3. März 2027"],
+        [
+            "Gesetz über die Finanzverwaltung",
+            "(Änderung vom ............; Controlling)",
+        ],
+        [
+            "Der Kantonsrat,",
+            "nach Einsichtnahme in den Antrag des Regierungsrates,",
+            "beschliesst:",
+        ],
+        [
+            "I. Das Gesetz über die Finanzverwaltung vom 9. Januar 2006",
+            "wird wie folgt geändert:",
+        ],
+        [
+            "§ 12. Der Regierungsrat legt die Grundsätze des Controllings fest.",
+            "Er kann die Aufgaben den Direktionen übertragen.",
+        ],
+        [
+            "§ 14 a. Die Direktionen erstatten dem Regierungsrat jährlich",
+            "Bericht über die Wirkung ihrer Leistungsgruppen.",
+        ],
+    ],
+    [
+        [
+            "§ 27. Die Finanzkontrolle prüft die Einhaltung der Vorgaben",
+            "von § 12 und § 14 a.",
+        ],
+        [
+            "II. Das Steuergesetz vom 8. Juni 1997 wird wie folgt",
+            "geändert:",
+        ],
+        ["§ 18. Die Einkommenssteuer wird nach dem Tarif erhoben."],
+        ["§ 20 a. Abzüge für die Kinderbetreuung sind zulässig."],
+        [
+            "III. Diese Gesetzesänderung untersteht dem fakultativen",
+            "Referendum.",
+        ],
+        ["Bericht"],
+        [
+            "1. Ausgangslage",
+            "Die Finanzverwaltung kennt heute kein einheitliches Controlling",
+            "nach § 99 des geltenden Rechts.",
+        ],
+    ],
+]
+
+# A row is a text block in each of the three columns, only the last column
+# holds the proposed wording
+synopse_pages = [
+    [
+        ["Geltendes Recht", "Antrag des Regierungsrates", "Antrag der Kommission"],
+        [
+            "Gemeindegesetz",
+            "Gemeindegesetz (Änderung)",
+            "Gemeindegesetz (Änderung vom ...)",
+        ],
+        [
+            "§ 4. Die Gemeinden regeln ihre Organisation selbst.",
+            "§ 5. Die Gemeinden regeln ihre Organisation in der Gemeindeordnung.",
+            "§ 5. Die Gemeinden regeln ihre Organisation in der Gemeindeordnung.",
+        ],
+        [
+            "",
+            "§ 7. Sie können Zweckverbände bilden.",
+            "§ 7 a. Zweckverbände geben sich Statuten.",
+        ],
+    ],
+    [
+        [
+            "§ 40. Die Rechnung wird jährlich abgelegt.",
+            "§ 41. Die Rechnung wird nach HRM2 abgelegt.",
+            "§ 41. Die Rechnung wird nach HRM2 abgelegt.",
+        ],
+        [
+            "",
+            "II. Das Finanzausgleichsgesetz vom 12. Juli 2010 wird wie folgt geändert:",
+            "II. Das Finanzausgleichsgesetz vom 12. Juli 2010 wird wie folgt geändert:",
+        ],
+        [
+            "§ 30. Der Ausgleich wird jährlich festgesetzt.",
+            "§ 31. Der Ausgleich wird alle zwei Jahre festgesetzt.",
+            "§ 33. Der Ausgleich wird alle drei Jahre festgesetzt.",
+        ],
+    ],
+]
+
+totalrevision_pages = [
+    [
+        ["Antrag des Regierungsrates vom 17. Juni 2027"],
+        ["Archivgesetz (ArchG)", "(vom ............)"],
+        [
+            "Der Kantonsrat,",
+            "nach Einsichtnahme in den Antrag des Regierungsrates,",
+            "beschliesst:",
+        ],
+        ["Es wird folgendes Gesetz erlassen:"],
+        ["§ 1. Dieses Gesetz regelt die Archivierung der Unterlagen", "des Kantons."],
+        ["§ 2. Das Staatsarchiv archiviert die Unterlagen der Behörden."],
+    ],
+    [
+        ["§ 3 a. Die Gemeinden führen eigene Archive."],
+        ["§ 12. Die Schutzfrist beträgt 30 Jahre."],
+        ["Anhang"],
+        [
+            "Änderung bisherigen Rechts:",
+            "1. Das Gesetz über die Information und den Datenschutz",
+            "vom 12. Februar 2007 wird wie folgt geändert:",
+        ],
+        ["§ 5. Archivierte Unterlagen unterstehen dem Archivgesetz."],
+        ["§ 11. Die Einsicht richtet sich nach dem Archivgesetz."],
+        [
+            "2. Das Gemeindegesetz vom 20. April 2015 wird wie folgt",
+            "geändert:",
+        ],
+        ["§ 40. Die Gemeindearchive werden nach dem Archivgesetz geführt."],
+        ["Bericht"],
+        ["Das geltende Archivgesetz stammt aus dem Jahr 1995, vgl. § 8."],
+    ],
+]
+
+golden = {
+    "portrait.pdf": {
+        "case": "portrait",
+        "primary_norms": ["§ 12", "§ 14 a", "§ 27"],
+        "secondary_norms": {"Steuergesetz vom 8. Juni 1997": ["§ 18", "§ 20 a"]},
+    },
+    "synopse.pdf": {
+        "case": "landscape",
+        "primary_norms": ["§ 5", "§ 7 a", "§ 41"],
+        "secondary_norms": {"Finanzausgleichsgesetz vom 12. Juli 2010": ["§ 33"]},
+    },
+    "totalrevision.pdf": {
+        "case": "totalrevision",
+        "primary_norms": ["§ 1", "§ 2", "§ 3 a", "§ 12"],
+        "secondary_norms": {
+            "Gesetz über die Information und den Datenschutz vom 12. Februar 2007": [
+                "§ 5",
+                "§ 11",
+            ],
+            "Gemeindegesetz vom 20. April 2015": ["§ 40"],
+        },
+    },
+}
+
+
+def draw_header_and_footer(pdf, width, height, number):
+    # Both lie outside body_bounds() and must not reach the extracted text
+    pdf.drawString(100, height - 30, "Kantonsrat des Kantons Zürich § 999.")
+    pdf.drawString(width / 2, 30, f"- {number} -")
+
+
+def write_portrait(path, pages):
+    width, height = A4
+    pdf = canvas.Canvas(path, pagesize=A4, invariant=True)
+    for number, blocks in enumerate(pages, start=1):
+        pdf.setFont("Helvetica", font_size)
+        draw_header_and_footer(pdf, width, height, number)
+        # Margin notes sit in the outer margin, which is cropped
+        margin_x = width - 80 if number % 2 else 20
+        pdf.drawString(margin_x, height - body_top, "§ 998.")
+        y = height - body_top
+        for block in blocks:
+            for line in block:
+                pdf.drawString(100, y, line)
+                y -= line_height
+            y -= block_gap - line_height
+        pdf.showPage()
+    pdf.save()
+
+
+def wrap(text, width):
+    lines = [""]
+    for word in text.split():
+        if lines[-1] and len(lines[-1]) + 1 + len(word) > width:
+            lines.append("")
+        lines[-1] = f"{lines[-1]} {word}".strip()
+    return lines
+
+
+def write_synopse(path, pages):
+    width, height = landscape(A4)
+    columns = [40, 310, 580]
+    pdf = canvas.Canvas(path, pagesize=(width, height), invariant=True)
+    for number, rows in enumerate(pages, start=1):
+        pdf.setFont("Helvetica", font_size)
+        draw_header_and_footer(pdf, width, height, number)
+        y = height - body_top
+        for row in rows:
+            cells = [wrap(text, 42) for text in row]
+            for x, lines in zip(columns, cells):
+                for k, line in enumerate(lines):
+                    pdf.drawString(x, y - k * line_height, line)
+            y -= max(len(lines) for lines in cells) * line_height
+            y -= block_gap - line_height
+        pdf.showPage()
+    pdf.save()
+
+
+def main():
+    write_portrait(os.path.join(corpus_dir, "portrait.pdf"), portrait_pages)
+    write_synopse(os.path.join(corpus_dir, "synopse.pdf"), synopse_pages)
+    write_portrait(os.path.join(corpus_dir, "totalrevision.pdf"), totalrevision_pages)
+    with open(os.path.join(corpus_dir, "golden.json"), "w", encoding="utf-8") as f:
+        json.dump(golden, f, indent=4, ensure_ascii=False, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from lxml import etree
+
+from cdws_parser import child, first, last_child_text, local_name
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Directory holding the recorded responses
+fixtures_dir = "cdws_fixtures"
+
+# Top-level record of each index
+record_names = {"KRVERSAND": "KRVersand", "GESCHAEFT": "Geschaeft"}
+
+# Query fields understood by the stand-in, their element and if they are dates
+query_fields = {
+    "datum_start": ("Datum", True),
+    "beginn_start": ("Beginn", True),
+    "vorlagennr": ("VorlagenNr", False),
+    "geschaeftsart": ("Geschaeftsart", False),
+    "krnr": ("KRNr", False),
+}
+
+index_path_pattern = re.compile(r"/Index/(\w+)/searchdetails$")
+file_path_pattern = re.compile(r"/Files/([^/]+)/([^/]+)/pdf$")
+condition_pattern = re.compile(r'(\w+)\s*(>=|<=|<|>|=|any|all)\s*"([^"]*)"', re.I)
+sort_pattern = re.compile(r"sortby\s+(\w+)/sort\.(ascending|descending)", re.I)
+date_patterns = [
+    (re.compile(r"\d{4}-\d{2}-\d{2}"), "%Y-%m-%d"),
+    (re.compile(r"\d{2}\.\d{2}\.\d{4}"), "%d.%m.%Y"),
+    (re.compile(r"\d{8}"), "%Y%m%d"),
+]
+
+
+def request_key(path, params):
+    # Paging and language parameters in any order map to the same key
+    return f"{path}?{urlencode(sorted(params))}"
+
+
+def normalize_date(text):
+    # Dates as "YYYY-MM-DD" whatever format the API or the query uses
+    for pattern, date_format in date_patterns:
+        match = pattern.search(text or "")
+        if match:
+            return datetime.strptime(match.group(), date_format).strftime("%Y-%m-%d")
+    return None
+
+
+def field_value(record, field):
+    name, is_date = query_fields[field]
+    # Prefer the record's own element over those of nested records
+    element = child(record, name)
+    if element is None:
+        element = first(record, name)
+    if element is None:
+        return None
+    if is_date:
+        return normalize_date(last_child_text(element))
+    return " ".join("".join(element.itertext()).split()).lower()
+
+
+def top_level_records(root, name):
+    return [
+        element
+        for element in root.iter(f"{{*}}{name}")
+        if not any(local_name(ancestor) == name for ancestor in element.iterancestors())
+    ]
+
+
+def record_units(root, records):
+    # The largest subtree around each record that holds no other record,
+    # e.g. a hit element wrapping the record
+    counts = {}
+    for record in records:
+        for ancestor in record.iterancestors():
+            counts[ancestor] = counts.get(ancestor, 0) + 1
+    units = []
+    for record in records:
+        unit = record
+        while unit.getparent() is not root and counts[unit.getparent()] == 1:
+            unit = unit.getparent()
+        units.append(unit)
+    return units
+
+
+def matches(fields, condition):
+    field, operator, value = condition
+    actual = fields.get(field)
+    if actual is None:
+        return False
+    if query_fields[field][1]:
+        value = normalize_date(value)
+        return {
+            ">=": actual >= value,
+            "<=": actual <= value,
+            ">": actual > value,
+            "<": actual < value,
+            "=": actual == value,
+        }.get(operator, False)
+
+    words = set(actual.split())
+    wanted = value.lower().split()
+    if operator == "any":
+        return any(word in words for word in wanted)
+    return all(word in words for word in wanted)
+
+
+class FixtureStore:
+    """Recorded CDWS responses, one body file per request plus an index.
+
+    record() is called by the HttpClient while recording. The stand-in
+    server uses respond() to replay exact requests. It also answers new
+    q/s/m combinations from the records of all recorded pages of an index.
+    """
+
+    def __init__(self, directory=fixtures_dir):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+        self.indexes = None
+
+    def record(self, url, body, content_type=None):
+        parts = urlsplit(url)
+        key = request_key(parts.path, parse_qsl(parts.query))
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"{name}.body"), "wb") as f:
+                f.write(body)
+            self.entries[key] = {
+                "url": url,
+                "file": f"{name}.body",
+                "content_type": content_type or "application/octet-stream",
+            }
+            # Keep the index readable even if the recording run is killed
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=4, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+
+    def body(self, entry):
+        with open(os.path.join(self.directory, entry["file"]), "rb") as f:
+            return f.read()
+
+    def load_indexes(self):
+        # Split every recorded search page into its records, per index
+        indexes = {}
+        for key, entry in self.entries.items():
+            match = index_path_pattern.search(urlsplit(key).path)
+            if not match or match.group(1) not in record_names:
+                continue
+            name = record_names[match.group(1)]
+            root = etree.fromstring(self.body(entry))
+            records = top_level_records(root, name)
+            index = indexes.setdefault(
+                match.group(1),
+                {"skeleton": root, "content_type": entry["content_type"], "units": {}},
+            )
+            for record, unit in zip(records, record_units(root, records)):
+                identity = record.get("OBJ_GUID") or etree.tostring(unit)
+                index["units"][identity] = (
+                    {field: field_value(record, field) for field in query_fields},
+                    unit,
+                )
+
+        # Keep the first page with its records removed as the frame of new pages
+        for name, index in indexes.items():
+            skeleton = index["skeleton"]
+            records = top_level_records(skeleton, record_names[name])
+            units = record_units(skeleton, records)
+            index["container"] = units[0].getparent() if units else skeleton
+            for unit in units:
+                unit.getparent().remove(unit)
+        self.indexes = indexes
+
+    def search(self, index_name, params):
+        """Answer a search with the q/s/m semantics of CDWS from the records."""
+        index = self.indexes[index_name]
+
+        query = params.get("q", "")
+        conditions = [
+            (field.lower(), operator.lower(), value)
+            for field, operator, value in condition_pattern.findall(
+                re.split(r"sortby", query, flags=re.I)[0]
+            )
+            if field.lower() in query_fields
+        ]
+        units = [
+            (fields, unit)
+            for fields, unit in index["units"].values()
+            if all(matches(fields, condition) for condition in conditions)
+        ]
+
+        sort = sort_pattern.search(query)
+        if sort and sort.group(1).lower() in query_fields:
+            field = sort.group(1).lower()
+            units.sort(
+                key=lambda item: item[0][field] or "",
+                reverse=sort.group(2).lower() == "descending",
+            )
+
+        start = int(params.get("s", 1)) - 1
+        size = int(params.get("m", 10))
+        # Build the page in a copy of the frame
+        skeleton = index["skeleton"]
+        container_path = skeleton.getroottree().getpath(index["container"])
+        page = etree.fromstring(etree.tostring(skeleton))
+        container = page.getroottree().xpath(container_path)[0]
+        for _, unit in units[start : start + size]:
+            container.append(etree.fromstring(etree.tostring(unit)))
+        return etree.tostring(page, xml_declaration=True, encoding="utf-8")
+
+    def respond(self, path, params):
+        """Return (status, body, content type) of a request to the stand-in."""
+        entry = self.entries.get(request_key(path, params))
+        if entry is not None:
+            return 200, self.body(entry), entry["content_type"]
+
+        match = index_path_pattern.search(path)
+        if match:
+            with self.lock:
+                if self.indexes is None:
+                    self.load_indexes()
+            if match.group(1) in self.indexes:
+                content_type = self.indexes[match.group(1)]["content_type"]
+                return 200, self.search(match.group(1), dict(params)), content_type
+
+        # PDFs are served by eDocument ID and version, whatever the prefix
+        match = file_path_pattern.search(path)
+        if match:
+            for key, entry in self.entries.items():
+                if urlsplit(key).path.endswith(match.group()):
+                    return 200, self.body(entry), entry["content_type"]
+
+        return 404, b"", "text/plain"
@@ -0,0 +1,183 @@
+import io
+import logging
+
+from lxml import etree
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+def local_name(element):
+    return etree.QName(element).localname
+
+
+def first(element, name):
+    # First descendant with the given name, like BeautifulSoup's find()
+    return next(element.iterdescendants(f"{{*}}{name}"), None)
+
+
+def child(element, name):
+    # First direct child with the given name
+    return next(element.iterchildren(f"{{*}}{name}"), None)
+
+
+def first_nocase(element, name):
+    # Case insensitive variant for responses parsed as HTML before
+    for descendant in element.iterdescendants(etree.Element):
+        if local_name(descendant).lower() == name:
+            return descendant
+    return None
+
+
+def text_of(element):
+    # All text of the element and its descendants, like BeautifulSoup's .text
+    if element is None:
+        return None
+    return "".join(element.itertext())
+
+
+def last_child_text(element):
+    # Text of the last child node, like BeautifulSoup's .contents[-1].text
+    if element is None:
+        return None
+    if len(element) == 0:
+        return element.text or ""
+    last = element[-1]
+    if last.tail:
+        return last.tail
+    return text_of(last)
+
+
+def last_document(element):
+    # Get the first document and its last version
+    document = first(element, "Dokument")
+    if document is None:
+        return None, None
+    edocument = first(document, "eDocument")
+    versions = list(document.iterdescendants("{*}Version"))
+    if edocument is None or edocument.get("ID") is None or not versions:
+        return None, None
+    return edocument.get("ID"), versions[-1].get("Nr")
+
+
+def release(element):
+    # Free the parsed element and everything parsed before it
+    element.clear(keep_tail=True)
+    for ancestor in element.iterancestors():
+        while ancestor.getprevious() is not None:
+            del ancestor.getparent()[0]
+
+
+def iter_elements(xml_data, name):
+    # Yield every element with the given name that is not nested in another one
+    depth = 0
+    context = etree.iterparse(
+        io.BytesIO(xml_data), events=("start", "end"), tag=f"{{*}}{name}"
+    )
+    for event, element in context:
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            yield element
+            release(element)
+
+
+def iter_dispatches(xml_data):
+    """Yield one compact record per KRVersand of a KRVERSAND response."""
+    for dispatch in iter_elements(xml_data, "KRVersand"):
+        affairs = []
+        for affair in dispatch.iterdescendants("{*}Geschaeft"):
+            # Only affairs wrapping another affair carry the data we need
+            if first(affair, "Geschaeft") is None:
+                continue
+            edoc_id, last_version = last_document(affair.getparent())
+            vorlage_nr = first(affair, "VorlagenNr")
+            affairs.append(
+                {
+                    "affair_type": text_of(first(affair, "Geschaeftsart")),
+                    "title": text_of(first(affair, "Titel")),
+                    "vorlage_nr": text_of(vorlage_nr),
+                    "edoc_id": edoc_id,
+                    "last_version": last_version,
+                }
+            )
+
+        yield {
+            "id": dispatch.get("OBJ_GUID"),
+            "date": last_child_text(first(dispatch, "Datum")),
+            "affairs": affairs,
+        }
+
+
+def compact_affair(affair):
+    steps = []
+    for step_type in affair.iterdescendants("{*}AblaufschrittTyp"):
+        step = step_type.getparent()
+        steps.append(
+            {
+                "action": text_of(step_type),
+                "abstract": text_of(first(step, "StatusText")),
+                "date": last_child_text(first(step, "Sitzungsdatum")),
+            }
+        )
+
+    edoc_id, last_version = last_document(affair)
+    return {
+        "krnr": text_of(first(affair, "KRNr")),
+        "start": last_child_text(child(affair, "Beginn")),
+        "vorlage_type": text_of(first(affair, "Geschaeftsart")),
+        "vorlage_title": text_of(first(affair, "Titel")),
+        "edoc_id": edoc_id,
+        "last_version": last_version,
+        "steps": steps,
+    }
+
+
+def iter_affair_trees(xml_data):
+    """Yield a list of compact records per top-level Geschaeft of a GESCHAEFT response.
+
+    The top-level affair comes first, followed by the affairs nested in it.
+    """
+    for affair in iter_elements(xml_data, "Geschaeft"):
+        yield [compact_affair(affair)] + [
+            compact_affair(nested) for nested in affair.iterdescendants("{*}Geschaeft")
+        ]
+
+
+def iter_affairs(xml_data):
+    """Yield one compact record per Geschaeft of a GESCHAEFT response.
+
+    Nested affairs are yielded after the affair containing them.
+    """
+    for tree in iter_affair_trees(xml_data):
+        yield from tree
+
+
+def iter_vorlagen(xml_data):
+    """Yield the procedural steps of each top-level Geschaeft with a VorlagenNr."""
+    for affair in iter_elements(xml_data, "Geschaeft"):
+        vorlagen_nr = next(
+            (
+                child
+                for child in affair.iterchildren(etree.Element)
+                if local_name(child).lower() == "vorlagennr"
+            ),
+            None,
+        )
+        if vorlagen_nr is None:
+            continue
+
+        steps = []
+        for step in affair.iterdescendants(etree.Element):
+            if local_name(step).lower() != "ablaufschritt":
+                continue
+            steps.append(
+                {
+                    "type": text_of(first_nocase(step, "ablaufschritttyp")),
+                    "date": text_of(first_nocase(step, "text")),
+                }
+            )
+
+        yield {"vorlagen_nr": text_of(vorlagen_nr).strip(), "steps": steps}
@@ -0,0 +1,148 @@
+import argparse
+import hashlib
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from cdws_fixtures import FixtureStore, fixtures_dir
+from http_client import TokenBucket
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Bytes written at once when the bandwidth is limited
+chunk_size = 16 * 1024
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        if server.bucket is not None:
+            server.bucket.acquire()
+        # Jitter also applies without a fixed latency
+        if server.latency or server.jitter:
+            time.sleep(max(0.0, server.latency + server.random_jitter()))
+
+        # Fail a share of the requests like an overloaded backend would
+        if server.inject_error():
+            self.send_body(503, b"", "text/plain")
+            return
+
+        parts = urlsplit(self.path)
+        status, body, content_type = server.fixtures.respond(
+            parts.path, parse_qsl(parts.query)
+        )
+        if status != 200:
+            self.send_body(status, body, content_type)
+            return
+
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_body(200, body, content_type, {"ETag": etag})
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        # Throttle the body to the configured bandwidth
+        for i in range(0, len(body), chunk_size):
+            chunk = body[i : i + chunk_size]
+            self.wfile.write(chunk)
+            if self.server.bandwidth:
+                time.sleep(len(chunk) / self.server.bandwidth)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """Stand-in for parlzhcdws.cmicloud.ch answering from recorded fixtures.
+
+    latency (plus up to jitter) seconds delay every response, error_rate is
+    the share of requests answered with 503, bandwidth limits the bytes per
+    second of each response and rate the requests per second of all clients.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        fixtures,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        bandwidth=None,
+        rate=None,
+        seed=0,
+    ):
+        super().__init__(address, ReplayHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.bandwidth = bandwidth
+        self.bucket = TokenBucket(rate, 1) if rate else None
+        # Seeded, so the same run sees the same errors
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+    def random_jitter(self):
+        with self.random_lock:
+            return self.random.uniform(0, self.jitter)
+
+    def inject_error(self):
+        with self.random_lock:
+            return self.random.random() < self.error_rate
+
+
+def serve(fixtures=fixtures_dir, host="127.0.0.1", port=8080, **options):
+    server = ReplayServer((host, port), FixtureStore(fixtures), **options)
+    logging.info(f"Replaying {fixtures} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay recorded CDWS responses, see main.py --record"
+    )
+    parser.add_argument("--fixtures", default=fixtures_dir)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, help="bytes per second")
+    parser.add_argument("--rate", type=float, help="requests per second")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    serve(
+        args.fixtures,
+        args.host,
+        args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        bandwidth=args.bandwidth,
+        rate=args.rate,
+        seed=args.seed,
+    )
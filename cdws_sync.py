@@ -0,0 +1,72 @@
+import json
+import logging
+import threading
+
+from http_client import client
+from metrics import metrics
+from records import write_json
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# File holding the high-water mark of every synced index
+sync_state_file = "sync_state.json"
+
+# Number of fetched entries per page, max is 1k
+page_size = 100
+
+# Scrapers of different indexes update the state file from parallel stages
+sync_state_lock = threading.Lock()
+
+
+def load_sync_state():
+    try:
+        with open(sync_state_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def get_high_water_mark(index):
+    # Latest start date stored for the index, None before the first sync
+    return load_sync_state().get(index)
+
+
+def set_high_water_mark(index, value):
+    with sync_state_lock:
+        state = load_sync_state()
+        # Never move the mark backwards, e.g. after a partial backfill
+        if state.get(index) is not None and state[index] >= value:
+            return
+        state[index] = value
+        # Replaced in one step, a reader never sees a half-written file
+        write_json(sync_state_file, state)
+
+
+def iter_pages(base_url, params, parse, max_pages=None):
+    """Yield the records of a CDWS search page by page using the s/m window.
+
+    parse turns the xml of one page into its top-level records. Paging stops
+    after the first page with fewer than page_size records, or as soon as the
+    caller stops iterating.
+    """
+    start = 1
+    pages = 0
+    while max_pages is None or pages < max_pages:
+        # Unchanged pages are revalidated instead of downloaded again
+        content = client.get(
+            base_url,
+            params={**params, "s": str(start), "m": str(page_size)},
+            revalidate=True,
+        )
+        pages += 1
+
+        with metrics.timer("xml_parse_seconds"):
+            records = list(parse(content))
+        metrics.count("xml_records", len(records))
+        logging.info(f"Fetched {len(records)} records from {base_url} at s={start}")
+        yield from records
+
+        if len(records) < page_size:
+            return
+        start += page_size
@@ -0,0 +1,418 @@
+import logging
+import os
+import sqlite3
+from datetime import date, datetime, timedelta, timezone
+
+from records import Dispatch, Vorlage, format_date, parse_date, read_json, write_json
+from text_store import TextStore, text_key
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Database holding the dispatches, their vorlagen and the extracted norms
+database_file = "krzh_dispatch.sqlite"
+
+# JSON file of the dispatches, imported once and kept up to date as export
+json_file = "krzh_dispatch_data.json"
+
+# PDFs failing to extract are retried after retry_delay * 2**(attempts - 1)
+# and given up after max_attempts
+retry_delay = timedelta(days=1)
+max_attempts = 6
+
+# Vorlage fields set by the scraper, stored in columns of the same name
+vorlage_columns = [
+    "title",
+    "affair_type",
+    "pdf_url",
+    "vorlagen_nr",
+    "rr_antrag",
+    "latest_step",
+    "latest_step_date",
+]
+
+# Dates stored as "DD.MM.YYYY" like in the JSON file
+date_columns = {"rr_antrag", "latest_step_date"}
+
+schema = """
+CREATE TABLE IF NOT EXISTS dispatches (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    guid TEXT,
+    content_hash TEXT
+);
+-- Dispatches are identified by their KRVersand OBJ_GUID, dispatches
+-- imported from the JSON file without one by their date
+CREATE UNIQUE INDEX IF NOT EXISTS dispatches_guid ON dispatches(guid);
+CREATE INDEX IF NOT EXISTS dispatches_date ON dispatches(date);
+
+CREATE TABLE IF NOT EXISTS vorlagen (
+    id INTEGER PRIMARY KEY,
+    dispatch_id INTEGER NOT NULL REFERENCES dispatches(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    title TEXT,
+    affair_type TEXT,
+    pdf_url TEXT,
+    vorlagen_nr TEXT,
+    rr_antrag TEXT,
+    latest_step TEXT,
+    latest_step_date TEXT,
+    totalrevision INTEGER,
+    text_key TEXT,
+    UNIQUE (dispatch_id, position)
+);
+CREATE INDEX IF NOT EXISTS vorlagen_vorlagen_nr ON vorlagen(vorlagen_nr);
+
+CREATE TABLE IF NOT EXISTS norms (
+    vorlage_id INTEGER NOT NULL REFERENCES vorlagen(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    law TEXT,
+    norm TEXT NOT NULL,
+    PRIMARY KEY (vorlage_id, kind, position)
+);
+
+CREATE TABLE IF NOT EXISTS failures (
+    vorlage_id INTEGER PRIMARY KEY REFERENCES vorlagen(id) ON DELETE CASCADE,
+    attempts INTEGER NOT NULL,
+    next_retry TEXT NOT NULL,
+    error TEXT
+);
+"""
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def norm_rows(norms):
+    # Norms are either a plain list or a mapping of law name to norms
+    if isinstance(norms, dict):
+        return [
+            (law, norm)
+            for law, law_norms in norms.items()
+            if isinstance(law_norms, list)
+            for norm in law_norms
+        ]
+    return [(None, norm) for norm in norms]
+
+
+def norms_from_rows(rows):
+    if not any(law is not None for law, _ in rows):
+        return [norm for _, norm in rows]
+    norms = {}
+    for law, norm in rows:
+        norms.setdefault(law, []).append(norm)
+    return norms
+
+
+class DispatchStore:
+    """SQLite store of the dispatches, their vorlagen and the extracted norms.
+
+    Dispatches go in and come out as records.Dispatch, import_json() and
+    export_json() convert from and to krzh_dispatch_data.json. The text
+    extracted from the PDFs lives in a TextStore, records only carry its
+    text_key and load_text() reads it on demand.
+    """
+
+    def __init__(self, path=database_file, import_file=json_file, texts=None):
+        self.texts = texts or TextStore()
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(schema)
+
+        # Take over the data of the JSON file on the first run
+        if self.is_empty() and import_file and os.path.exists(import_file):
+            self.import_json(import_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def is_empty(self):
+        return (
+            self.connection.execute("SELECT 1 FROM dispatches LIMIT 1").fetchone()
+            is None
+        )
+
+    def dispatch_index(self):
+        """Return {guid: (date, content_hash)} of all dispatches with a GUID.
+
+        Dates are "YYYY-MM-DD".
+        """
+        return {
+            row["guid"]: (row["date"], row["content_hash"])
+            for row in self.connection.execute(
+                "SELECT guid, date, content_hash FROM dispatches "
+                "WHERE guid IS NOT NULL"
+            )
+        }
+
+    def find_dispatch(self, dispatch):
+        # By GUID, or a dispatch of the same day imported without one
+        row = None
+        if dispatch.guid is not None:
+            row = self.connection.execute(
+                "SELECT id FROM dispatches WHERE guid = ?", (dispatch.guid,)
+            ).fetchone()
+        if row is None:
+            row = self.connection.execute(
+                "SELECT id FROM dispatches WHERE date = ? AND guid IS NULL "
+                "ORDER BY id LIMIT 1",
+                (dispatch.date.isoformat(),),
+            ).fetchone()
+        return row["id"] if row is not None else None
+
+    def latest_date(self):
+        return self.connection.execute("SELECT MAX(date) FROM dispatches").fetchone()[0]
+
+    def add_dispatch(self, dispatch):
+        """Insert or update a Dispatch and its vorlagen.
+
+        Extracted data is kept for vorlagen whose PDF did not change.
+        """
+        with self.connection:
+            values = (dispatch.date.isoformat(), dispatch.guid, dispatch.content_hash)
+            dispatch_id = self.find_dispatch(dispatch)
+            if dispatch_id is None:
+                dispatch_id = self.connection.execute(
+                    "INSERT INTO dispatches (date, guid, content_hash) "
+                    "VALUES (?, ?, ?) RETURNING id",
+                    values,
+                ).fetchone()["id"]
+            else:
+                self.connection.execute(
+                    "UPDATE dispatches SET date = ?, guid = ?, content_hash = ? "
+                    "WHERE id = ?",
+                    values + (dispatch_id,),
+                )
+            stored_urls = {
+                row["position"]: row["pdf_url"]
+                for row in self.connection.execute(
+                    "SELECT position, pdf_url FROM vorlagen WHERE dispatch_id = ?",
+                    (dispatch_id,),
+                )
+            }
+
+            updates = ", ".join(
+                f"{column} = excluded.{column}" for column in vorlage_columns
+            )
+            for position, vorlage in enumerate(dispatch.vorlagen):
+                cursor = self.connection.execute(
+                    "INSERT INTO vorlagen "
+                    f"(dispatch_id, position, {', '.join(vorlage_columns)}) "
+                    f"VALUES (?, ?{', ?' * len(vorlage_columns)}) "
+                    f"ON CONFLICT (dispatch_id, position) DO UPDATE SET {updates} "
+                    "RETURNING id",
+                    [dispatch_id, position]
+                    + [
+                        (
+                            format_date(getattr(vorlage, column))
+                            if column in date_columns
+                            else getattr(vorlage, column)
+                        )
+                        for column in vorlage_columns
+                    ],
+                )
+                vorlage_id = cursor.fetchone()["id"]
+                if vorlage.primary_norms is not None:
+                    self.write_fields(
+                        vorlage_id,
+                        vorlage.totalrevision,
+                        vorlage.text_key,
+                        vorlage.primary_norms,
+                        vorlage.secondary_norms,
+                    )
+                elif stored_urls.get(position, vorlage.pdf_url) != vorlage.pdf_url:
+                    # A re-published dispatch points to another PDF
+                    self.clear_fields(vorlage_id)
+
+            # Drop vorlagen no longer part of a re-published dispatch
+            self.connection.execute(
+                "DELETE FROM vorlagen WHERE dispatch_id = ? AND position >= ?",
+                (dispatch_id, len(dispatch.vorlagen)),
+            )
+
+    def update_vorlage(self, vorlage_id, fields):
+        """Store the fields extracted from the PDF of a vorlage."""
+        with self.connection:
+            # The text goes to the text store, the vorlage only keeps its key
+            (pdf_url,) = self.connection.execute(
+                "SELECT pdf_url FROM vorlagen WHERE id = ?", (vorlage_id,)
+            ).fetchone()
+            key = text_key(pdf_url)
+            self.texts.put(key, fields)
+            self.write_fields(
+                vorlage_id,
+                fields.get("Totalrevision", False),
+                key,
+                fields["primary_norms"],
+                fields["secondary_norms"],
+            )
+
+    def write_fields(
+        self, vorlage_id, totalrevision, key, primary_norms, secondary_norms
+    ):
+        self.connection.execute(
+            "UPDATE vorlagen SET totalrevision = ?, text_key = ? WHERE id = ?",
+            (1 if totalrevision else None, key, vorlage_id),
+        )
+        self.connection.execute(
+            "DELETE FROM failures WHERE vorlage_id = ?", (vorlage_id,)
+        )
+        self.connection.execute("DELETE FROM norms WHERE vorlage_id = ?", (vorlage_id,))
+        for kind, norms in [("primary", primary_norms), ("secondary", secondary_norms)]:
+            self.connection.executemany(
+                "INSERT INTO norms (vorlage_id, kind, position, law, norm) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (vorlage_id, kind, position, law, norm)
+                    for position, (law, norm) in enumerate(norm_rows(norms or []))
+                ],
+            )
+
+    def clear_fields(self, vorlage_id):
+        self.connection.execute(
+            "UPDATE vorlagen SET totalrevision = NULL, text_key = NULL WHERE id = ?",
+            (vorlage_id,),
+        )
+        for table in ["norms", "failures"]:
+            self.connection.execute(
+                f"DELETE FROM {table} WHERE vorlage_id = ?", (vorlage_id,)
+            )
+
+    def record_failure(self, vorlage_id, error):
+        """Remember a failed extraction and when to try again, return the attempts."""
+        with self.connection:
+            row = self.connection.execute(
+                "SELECT attempts FROM failures WHERE vorlage_id = ?", (vorlage_id,)
+            ).fetchone()
+            attempts = (row["attempts"] if row else 0) + 1
+            next_retry = datetime.now(timezone.utc) + retry_delay * 2 ** (attempts - 1)
+            self.connection.execute(
+                "INSERT INTO failures (vorlage_id, attempts, next_retry, error) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (vorlage_id) DO UPDATE SET "
+                "attempts = excluded.attempts, next_retry = excluded.next_retry, "
+                "error = excluded.error",
+                (
+                    vorlage_id,
+                    attempts,
+                    next_retry.isoformat(timespec="seconds"),
+                    str(error),
+                ),
+            )
+        return attempts
+
+    def pending_vorlagen(self, reextract=False):
+        """Return (id, vorlage) pairs still lacking extracted fields, in file order.
+
+        Failed vorlagen are left out until their next retry is due and for
+        good after max_attempts.
+        """
+        query = (
+            "SELECT vorlagen.* FROM vorlagen JOIN dispatches ON dispatches.id = dispatch_id "
+            "LEFT JOIN failures ON failures.vorlage_id = vorlagen.id "
+            "WHERE (failures.vorlage_id IS NULL "
+            "OR (failures.attempts < ? AND failures.next_retry <= ?)) "
+            + ("" if reextract else "AND text_key IS NULL ")
+            + "ORDER BY dispatches.date DESC, position"
+        )
+        return [
+            (row["id"], self.vorlage_record(row, {}))
+            for row in self.connection.execute(query, (max_attempts, utc_now()))
+        ]
+
+    def vorlage_record(self, row, norms):
+        vorlage = Vorlage(
+            **{
+                column: (
+                    parse_date(row[column]) if column in date_columns else row[column]
+                )
+                for column in vorlage_columns
+            }
+        )
+        if row["text_key"] is None:
+            return vorlage
+
+        vorlage.totalrevision = bool(row["totalrevision"])
+        vorlage.text_key = row["text_key"]
+        vorlage.primary_norms = norms_from_rows(norms.get((row["id"], "primary"), []))
+        vorlage.secondary_norms = norms_from_rows(
+            norms.get((row["id"], "secondary"), [])
+        )
+        return vorlage
+
+    def load_text(self, vorlage):
+        """Return the text fields extracted from the PDF of a vorlage, if any."""
+        if vorlage.text_key is None:
+            return None
+        return self.texts.get(vorlage.text_key)
+
+    def iter_dispatches(self, since=None):
+        """Yield the Dispatches from since ("YYYY-MM-DD") on, newest first."""
+        condition = "" if since is None else "WHERE dispatches.date >= ? "
+        params = [] if since is None else [since]
+
+        rows = self.connection.execute(
+            "SELECT dispatches.id AS dispatch_row_id, dispatches.date AS dispatch_date, "
+            "dispatches.guid AS dispatch_guid, "
+            "dispatches.content_hash AS dispatch_hash, vorlagen.* "
+            "FROM dispatches LEFT JOIN vorlagen ON dispatches.id = dispatch_id "
+            + condition
+            + "ORDER BY dispatches.date DESC, dispatches.id, position",
+            params,
+        ).fetchall()
+
+        norms = {}
+        for row in self.connection.execute(
+            "SELECT norms.* FROM norms JOIN vorlagen ON vorlagen.id = vorlage_id "
+            "JOIN dispatches ON dispatches.id = dispatch_id "
+            + condition
+            + "ORDER BY vorlage_id, kind, norms.position",
+            params,
+        ):
+            norms.setdefault((row["vorlage_id"], row["kind"]), []).append(
+                (row["law"], row["norm"])
+            )
+
+        dispatch = None
+        for row in rows:
+            if dispatch is None or dispatch_id != row["dispatch_row_id"]:
+                if dispatch is not None:
+                    yield dispatch
+                dispatch_id = row["dispatch_row_id"]
+                dispatch = Dispatch(
+                    date=date.fromisoformat(row["dispatch_date"]),
+                    guid=row["dispatch_guid"],
+                    content_hash=row["dispatch_hash"],
+                )
+            if row["id"] is not None:
+                dispatch.vorlagen.append(self.vorlage_record(row, norms))
+        if dispatch is not None:
+            yield dispatch
+
+    def import_json(self, path):
+        for record in read_json(path):
+            # Files of earlier versions hold the text inline
+            for vorlage in record["Vorlagen"]:
+                if "original_pdf_data" in vorlage:
+                    vorlage["text_key"] = text_key(vorlage["PDF_URL"])
+                    self.texts.put(vorlage["text_key"], vorlage)
+            self.add_dispatch(Dispatch.from_legacy(record))
+        logging.info(f"Imported {path} into the dispatch store")
+
+    def export_json(self, path=json_file):
+        """Write all dispatches in the format of krzh_dispatch_data.json."""
+        write_json(path, [dispatch.to_legacy() for dispatch in self.iter_dispatches()])
+
+
+if __name__ == "__main__":
+    with DispatchStore() as store:
+        store.export_json()
@@ -1,25 +1,58 @@
+import gzip
+import hashlib
+import inspect
 import json
+import os
+import sqlite3
 import arrow
 import logging
 
+from dispatch_store import DispatchStore, database_file, json_file
+from law_index import LawIndex, law_entries
+from records import Initiative, format_date, read_json
+from search_index import build_index, search_dir
+
+# Optional, only needed for pre-compressed .br copies
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# Directory holding the rendered fragments of each page
+fragment_cache_dir = "page_cache"
+
+# Directory holding the archive of each page
+archive_dir = "archive"
+
+# Number of initiatives per archive page
+archive_page_size = 50
 
-def setup_html_string(title):
+# Directory holding a page per law changed by the vorlagen
+law_dir = "laws"
+
+
+def setup_html_string(title, stylesheet="styles.css", updated=True):
     """Set up the initial HTML structure and styles."""
+    updated_html = (
+        f'<div class="updated">Last updated: {arrow.now().format("DD.MM.YYYY HH:mm")}</div>'
+        if updated
+        else ""
+    )
     return f"""
     <!DOCTYPE html>
     <html>
         <head>
             <meta charset="utf-8">
-            <link rel="stylesheet" type="text/css" href="styles.css">
+            <link rel="stylesheet" type="text/css" href="{stylesheet}">
             <title>{title}</title>
         </head>
         <body>
             <div class="container">
                 <h1>{title}</h1>
-                <div class="updated">Last updated: {arrow.now().format("DD.MM.YYYY HH:mm")}</div>
+                {updated_html}
     """
 
 
@@ -39,120 +72,451 @@ def format_secondary_norms(secondary_norms):
     return "<br></br>".join(formatted_norms)
 
 
-def process_krzh_dispatch_data(data):
-    """Process data specific to krzh_dispatch_data.json."""
-    one_year_ago = arrow.utcnow().shift(years=-1)
-    html_string = ""
+def cutoff_date():
+    # Items published on or before this day are older than a year
+    return arrow.utcnow().shift(years=-1).date()
 
-    for item in data:
-        datum = item.get("Datum KR-Versand", "")
-        published = arrow.get(datum, "DD.MM.YYYY")
 
-        if published < one_year_ago:
-            continue
+def cutoff_key():
+    return format_date(cutoff_date(), "%Y%m%d")
 
-        html_string += f"<h3>KR-Versand vom {datum}</h3>"
-        vorlagen = item.get("Vorlagen", [])
 
-        if vorlagen:
-            for vorlage in vorlagen:
-                primary_norms = ", ".join(
-                    vorlage.get("primary_norms", ["N/A"])
-                ).replace("§", "")
-                secondary_norms = format_secondary_norms(
-                    vorlage.get("secondary_norms", {})
-                )
+def render_dispatch(item):
+    parts = [f"<h3>KR-Versand vom {format_date(item.date)}</h3>"]
 
-                html_string += f"""
+    if item.vorlagen:
+        for vorlage in item.vorlagen:
+            primary_norms = ", ".join(vorlage.primary_norms or ["N/A"]).replace("§", "")
+            secondary_norms = format_secondary_norms(vorlage.secondary_norms or {})
+
+            parts.append(f"""
                 <table>
-                    <tr><th>Geschäftstitel</th><td>{vorlage.get("Geschäftstitel", "N/A")}</td></tr>
-                    <tr><th>PDF URL</th><td><a href="{vorlage.get("PDF_URL", "#")}">{vorlage.get("PDF_URL", "N/A")}</a></td></tr>
-                    <tr><th>Datum Antrag RR</th><td>{vorlage.get("RR_Antrag", "N/A")}</td></tr>
-                    <tr><th>Letzter Verfahrensschritt</th><td>{vorlage.get("latest_step", "N/A")} am {vorlage.get("latest_step_date", "N/A")}</td></tr>
+                    <tr><th>Geschäftstitel</th><td>{vorlage.title}</td></tr>
+                    <tr><th>PDF URL</th><td><a href="{vorlage.pdf_url}">{vorlage.pdf_url}</a></td></tr>
+                    <tr><th>Datum Antrag RR</th><td>{format_date(vorlage.rr_antrag)}</td></tr>
+                    <tr><th>Letzter Verfahrensschritt</th><td>{vorlage.latest_step} am {format_date(vorlage.latest_step_date)}</td></tr>
                     <tr><th>Geänderte § Haupterlass</th><td>{primary_norms}</td></tr>
                     <tr><th>Geänderte § Nebenerlasse</th><td>{secondary_norms}</td></tr>
                 </table>
-                """
-        else:
-            html_string += "<p>Keine Vorlagen gefunden</p>"
+                """)
+    else:
+        parts.append("<p>Keine Vorlagen gefunden</p>")
 
-    return html_string
+    return "".join(parts)
 
 
-def process_krzh_initiatives(data):
-    one_year_ago = arrow.utcnow().shift(years=-1)
-    html_string = ""
+def process_krzh_dispatch_data(data, fragments=None):
+    """Process data specific to krzh_dispatch_data.json."""
+    cutoff = cutoff_date()
+    parts = []
 
     for item in data:
-        decision_date = item.get("decision_date", "")
-        published = arrow.get(decision_date, "YYYYMMDD")
+        if item.date <= cutoff:
+            continue
+
+        parts.append(render_cached(item, render_dispatch, fragments))
+
+    return "".join(parts)
+
+
+def render_initiative(item):
+    rows = [
+        ("Art der Vorlage", item.vorlage_type),
+        ("Betreff", item.vorlage_title),
+        ("Entscheid", item.decision),
+        ("Zusammenfassung des Entscheids", item.decision_abstract),
+        ("Datum Entscheid", format_date(item.decision_date)),
+        ("PDF URL", f'<a href="{item.pdf_url}">{item.pdf_url}</a>'),
+    ]
+    parts = [f"<h3>{item.krnr}</h3>", "<table>"]
+    for field_name, formatted_value in rows:
+        parts.append(f"<tr><th>{field_name}</th><td>{formatted_value}</td></tr>")
+    parts.append("</table>")
+    return "".join(parts)
+
 
-        if published < one_year_ago:
+def process_krzh_initiatives(data, fragments=None):
+    cutoff = cutoff_date()
+    parts = []
+
+    for item in data:
+        if item.decision_date is None or item.decision_date <= cutoff:
             continue
 
-        html_string += f"<h3>{item.get('krnr', 'N/A')}</h3>"
-        html_string += "<table>"
-
-        for key, value in item.items():
-            if key != "krnr":
-                # Base field_name and formatted_value on the key
-                field_name = key
-                formatted_value = value
-
-                # Adjust field_name and formatted_value for specific keys
-                if key == "vorlage_type":
-                    field_name = "Art der Vorlage"
-                elif key == "vorlage_title":
-                    field_name = "Betreff"
-                elif key == "decision":
-                    field_name = "Entscheid"
-                elif key == "decision_abstract":
-                    field_name = "Zusammenfassung des Entscheids"
-                elif key == "decision_date":
-                    field_name = "Datum Entscheid"
-                    formatted_value = arrow.get(value, "YYYYMMDD").format("DD.MM.YYYY")
-                elif key == "pdf_url":
-                    field_name = "PDF URL"
-                    formatted_value = f'<a href="{value}">{value}</a>'
-
-                # Add this row to the HTML string
-                html_string += (
-                    f"<tr><th>{field_name}</th><td>{formatted_value}</td></tr>"
-                )
-
-        html_string += "</table>"
-
-    return html_string
-
-
-def generate_page(filename, title, htmlname):
-    """Main function to create the HTML files from JSON data."""
-    html_string = setup_html_string(title)
+        parts.append(render_cached(item, render_initiative, fragments))
+
+    return "".join(parts)
+
+
+def content_hash(value):
+    serialized = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
 
+def render_cached(item, render, fragments):
+    # Reuse the fragment rendered for the same content in an earlier run,
+    # keyed by the JSON form of the item like the caches written before
+    if fragments is None:
+        return render(item)
+    key = content_hash(item.to_legacy())
+    if key not in fragments.previous:
+        fragments.rendered += 1
+    fragment = fragments.previous.get(key) or render(item)
+    fragments.current[key] = fragment
+    return fragment
+
+
+def renderer_hash():
+    # Hash of the code rendering the fragments, a change to it invalidates
+    # all cached fragments
+    functions = [
+        render_dispatch,
+        render_initiative,
+        format_secondary_norms,
+        format_date,
+    ]
+    source = "".join(inspect.getsource(function) for function in functions)
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class FragmentCache:
+    """Rendered HTML fragments of one page, keyed by the hash of their item.
+
+    The cache is dropped when it was written by a different renderer, see
+    renderer_hash().
+    """
+
+    def __init__(self, htmlname):
+        self.path = os.path.join(fragment_cache_dir, f"{htmlname}.json")
+        self.renderer = renderer_hash()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            cached = {}
+        if cached.get("renderer") != self.renderer:
+            cached = {}
+        self.previous = cached.get("fragments", {})
+        self.body_hash = cached.get("body_hash")
+        self.current = {}
+        self.rendered = 0
+
+    def save(self, body_hash):
+        # Only keep the fragments used on the current page
+        os.makedirs(fragment_cache_dir, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "renderer": self.renderer,
+                    "body_hash": body_hash,
+                    "fragments": self.current,
+                },
+                f,
+                ensure_ascii=False,
+            )
+
+
+def write_if_changed(path, content, compress=()):
+    """Write content to path and its pre-compressed copies, unless unchanged."""
+    data = content.encode("utf-8")
     try:
-        with open(filename, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+
+    with open(path, "wb") as f:
+        f.write(data)
+    if "gzip" in compress:
+        # A fixed mtime keeps the compressed copy identical for identical pages
+        with open(f"{path}.gz", "wb") as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if "br" in compress and brotli is not None:
+        with open(f"{path}.br", "wb") as f:
+            f.write(brotli.compress(data))
+    return True
+
+
+def archive_page(title, body):
+    # Archive pages live two levels below styles.css and carry no timestamp,
+    # so they only change when their content does
+    return "".join(
+        [setup_html_string(title, "../../styles.css", updated=False), body]
+        + ["</div></body></html>"]
+    )
+
 
-        if filename == "krzh_dispatch_data.json":
-            html_string += process_krzh_dispatch_data(data)
-        elif filename == "krzh_initiatives_data.json":
-            html_string += process_krzh_initiatives(data)
+def link_list(links):
+    items = "".join(f'<li><a href="{href}">{text}</a></li>' for href, text in links)
+    return f"<ul>{items}</ul>"
+
+
+def archive_names(dispatches):
+    # File name of each KR-Versand, further ones on the same day get a number
+    names = []
+    counts = {}
+    for item in dispatches:
+        counts[item.date] = counts.get(item.date, 0) + 1
+        number = counts[item.date]
+        suffix = f"-{number}" if number > 1 else ""
+        names.append(f"{item.date.isoformat()}{suffix}.html")
+    return names
+
+
+def write_dispatch_archive(store, title, directory, compress=()):
+    # One file per KR-Versand plus an index of all of them
+    fragments = FragmentCache(f"{os.path.basename(directory)}_archive")
+    links = []
+    written = 0
+    dispatches = list(store.iter_dispatches())
+    for item, name in zip(dispatches, archive_names(dispatches)):
+        datum = format_date(item.date)
+        body = render_cached(item, render_dispatch, fragments)
+        written += write_if_changed(
+            os.path.join(directory, name),
+            archive_page(f"{title} - {datum}", body),
+            compress,
+        )
+        links.append((name, f"KR-Versand vom {datum}"))
+
+    written += write_if_changed(
+        os.path.join(directory, "index.html"),
+        archive_page(f"{title} - Archiv", link_list(links)),
+        compress,
+    )
+    fragments.save(None)
+    return written
+
+
+def write_initiatives_archive(data, title, directory, compress=()):
+    # Pages of archive_page_size initiatives plus an index of all pages
+    fragments = FragmentCache(f"{os.path.basename(directory)}_archive")
+    pages = [
+        data[i : i + archive_page_size] for i in range(0, len(data), archive_page_size)
+    ]
+    links = []
+    written = 0
+    for number, items in enumerate(pages, start=1):
+        name = f"page-{number}.html"
+        navigation = [("index.html", "Übersicht")]
+        if number > 1:
+            navigation.append((f"page-{number - 1}.html", "Zurück"))
+        if number < len(pages):
+            navigation.append((f"page-{number + 1}.html", "Weiter"))
+
+        body = "".join(
+            [render_cached(item, render_initiative, fragments) for item in items]
+            + [link_list(navigation)]
+        )
+        written += write_if_changed(
+            os.path.join(directory, name),
+            archive_page(f"{title} - Seite {number}", body),
+            compress,
+        )
+        links.append((name, f"Seite {number}"))
+
+    written += write_if_changed(
+        os.path.join(directory, "index.html"),
+        archive_page(f"{title} - Archiv", link_list(links)),
+        compress,
+    )
+    fragments.save(None)
+    return written
+
+
+def render_law(law, vorlagen):
+    parts = [link_list([("index.html", "Übersicht")])]
+    for paragraph, keys in law["paragraphs"].items():
+        parts.append(f"<h3>{paragraph}</h3><table>")
+        for key in keys:
+            vorlage = vorlagen[key]
+            parts.append(
+                f"<tr><th>KR-Versand vom {vorlage['date']}</th><td>"
+                f"{vorlage['nr']}: <a href=\"{vorlage['pdf']}\">{vorlage['title']}</a>"
+                f"<br>Letzter Verfahrensschritt: {vorlage['latest_step']} am "
+                f"{vorlage['latest_step_date']}</td></tr>"
+            )
+        parts.append("</table>")
+    return "".join(parts)
+
+
+def law_page(title, body):
+    # Law pages live one level below styles.css
+    return "".join(
+        [setup_html_string(title, "../styles.css", updated=False), body]
+        + ["</div></body></html>"]
+    )
 
-        html_string += "</body></html>"
 
-        with open(f"{htmlname}.html", "w", encoding="utf-8") as f:
-            f.write(html_string)
+def generate_law_pages(path=database_file, compress=()):
+    """Write a page per law changed by the extracted vorlagen to laws/.
 
-    except (FileNotFoundError, json.JSONDecodeError) as e:
+    The index behind the pages is kept in krzh_laws.json. Only the pages of
+    laws whose vorlagen were added, changed or removed since the last run
+    are rendered again.
+    """
+    with DispatchStore(path) as store:
+        entries = law_entries(store.iter_dispatches())
+    index = LawIndex()
+    affected = index.update(entries)
+
+    os.makedirs(law_dir, exist_ok=True)
+    written = 0
+    for key, law in index.laws.items():
+        output = os.path.join(law_dir, f"{key}.html")
+        if key in affected or not os.path.exists(output):
+            written += write_if_changed(
+                output,
+                law_page(f"KRZH - {law['name']}", render_law(law, index.vorlagen)),
+                compress,
+            )
+    for key in affected - index.laws.keys():
+        for suffix in ["", ".gz", ".br"]:
+            try:
+                os.unlink(os.path.join(law_dir, f"{key}.html{suffix}"))
+            except FileNotFoundError:
+                pass
+
+    links = []
+    for key, law in sorted(index.laws.items(), key=lambda item: item[1]["name"]):
+        count = len(set().union(*law["paragraphs"].values()))
+        label = "Vorlage" if count == 1 else "Vorlagen"
+        links.append((f"{key}.html", f"{law['name']} ({count} {label})"))
+    written += write_if_changed(
+        os.path.join(law_dir, "index.html"),
+        law_page("KRZH - Geänderte Erlasse", link_list(links)),
+        compress,
+    )
+    index.save()
+    logging.info(f"Updated {len(affected)} laws, wrote {written} files to {law_dir}")
+    return written
+
+
+def search_documents(store, archive_directory=None):
+    # Every vorlage with its title and extracted text, oldest first
+    dispatches = list(store.iter_dispatches())
+    for item, name in reversed(list(zip(dispatches, archive_names(dispatches)))):
+        for vorlage in item.vorlagen:
+            entry = {
+                "date": format_date(item.date),
+                "nr": vorlage.vorlagen_nr,
+                "title": vorlage.title,
+                "pdf": vorlage.pdf_url,
+            }
+            if archive_directory is not None:
+                entry["page"] = f"{archive_directory}/{name}"
+            text = store.load_text(vorlage) or {}
+            pages = text.get("original_pdf_data") or []
+            yield entry, "\n".join([vorlage.title or ""] + pages)
+
+
+def write_search_index(store, directory, archive_directory=None, compress=()):
+    """Write the search index of all vorlagen to directory, see search.js."""
+    os.makedirs(directory, exist_ok=True)
+    files = build_index(search_documents(store, archive_directory))
+    written = 0
+    for name, data in files.items():
+        written += write_if_changed(
+            os.path.join(directory, name),
+            json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+            compress,
+        )
+
+    # Drop shards left over from an index with more of them
+    for name in os.listdir(directory):
+        if name.startswith("shard-") and name.split(".")[0] + ".json" not in files:
+            os.unlink(os.path.join(directory, name))
+    return written
+
+
+def search_box(directory):
+    return f"""
+    <div class="search" data-index="{directory}">
+        <input type="search" placeholder="Volltextsuche, z.B. Steuergesetz § 18" aria-label="Volltextsuche">
+        <ol class="search-results"></ol>
+    </div>
+    <script src="search.js" defer></script>
+    """
+
+
+def generate_page(filename, title, htmlname, archive=False, compress=(), search=False):
+    """Main function to create the HTML files from JSON data.
+
+    With archive the full history is also written to archive/<htmlname>/,
+    compress lists pre-compressed copies to write next to each file
+    ("gzip", "br"). With search the page gets a search box over the text
+    extracted from the PDFs, its index is written to search/<htmlname>/.
+    """
+    # Callers of earlier versions pass the JSON file of the dispatches
+    if filename == json_file:
+        filename = database_file
+    if filename not in (database_file, "krzh_initiatives_data.json"):
+        raise ValueError(f"Unknown data file {filename}")
+
+    fragments = FragmentCache(htmlname)
+    directory = os.path.join(archive_dir, htmlname)
+    index_directory = os.path.join(search_dir, htmlname)
+    if "br" in compress and brotli is None:
+        logging.warning("brotli is not installed, skipping .br files")
+    if archive:
+        os.makedirs(directory, exist_ok=True)
+
+    try:
+        if filename == database_file:
+            # Only load the dispatches shown on the page
+            one_year_ago = arrow.utcnow().shift(years=-1)
+            with DispatchStore(filename) as store:
+                data = list(store.iter_dispatches(one_year_ago.format("YYYY-MM-DD")))
+                if archive:
+                    written = write_dispatch_archive(store, title, directory, compress)
+                    logging.info(f"Wrote {written} files to {directory}")
+                if search:
+                    written = write_search_index(
+                        store,
+                        index_directory,
+                        directory if archive else None,
+                        compress,
+                    )
+                    logging.info(f"Wrote {written} files to {index_directory}")
+            body = process_krzh_dispatch_data(data, fragments)
+            if search:
+                body = search_box(index_directory) + body
+        else:
+            data = [Initiative.from_legacy(entry) for entry in read_json(filename)]
+            if archive:
+                written = write_initiatives_archive(data, title, directory, compress)
+                logging.info(f"Wrote {written} files to {directory}")
+            body = process_krzh_initiatives(data, fragments)
+
+        if archive:
+            body += link_list([(f"{directory}/index.html", "Archiv")])
+
+        # Leave the page and its timestamp alone if the content did not change
+        body_hash = content_hash([title, body])
+        output = f"{htmlname}.html"
+        if body_hash == fragments.body_hash and os.path.exists(output):
+            logging.info(f"{output} is unchanged, not writing it")
+            return False
+
+        html_string = "".join([setup_html_string(title), body, "</body></html>"])
+        write_if_changed(output, html_string, compress)
+        fragments.save(body_hash)
+        logging.info(
+            f"Wrote {output}, rendered {fragments.rendered} of "
+            f"{len(fragments.current)} fragments"
+        )
+        return True
+
+    except (FileNotFoundError, json.JSONDecodeError, sqlite3.Error) as e:
         print(f"Error processing {filename}: {e}")
 
 
 if __name__ == "__main__":
-    generate_page(
-        "krzh_dispatch_data.json", "KRZH - Vorlagen Ratsversand", "krzh_dispatch"
-    )
+    generate_page(database_file, "KRZH - Vorlagen Ratsversand", "krzh_dispatch")
     generate_page(
         "krzh_initiatives_data.json",
         "KRZH - Initiativen",
         "krzh_initiatives",
     )
+    generate_law_pages()
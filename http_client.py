@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Host of the CDWS API, replaced by a stand-in when replaying fixtures
+cdws_host = "https://parlzhcdws.cmicloud.ch"
+
+# Politeness towards parlzhcdws.cmicloud.ch
+requests_per_second = 1.0
+burst_size = 2
+
+# Connections kept alive per host, enough for all download workers
+pool_size = 8
+
+# Connect and read timeout in seconds
+timeout = (10, 120)
+
+# Failed requests are repeated after backoff_factor * 2**attempt seconds
+max_retries = 4
+backoff_factor = 2.0
+
+# Bodies and validators of responses revalidated with ETag/Last-Modified
+http_cache_dir = "http_cache"
+
+
+def replace_file(path, data):
+    # Write to a temporary file first so readers never see partial files
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting how often requests are sent."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            # Reserve a token, a negative balance is the time we have to wait
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class HttpClient:
+    """Pooled, rate-limited HTTP client shared by all scrapers."""
+
+    def __init__(self, rate=requests_per_second, burst=burst_size):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.bucket = TokenBucket(rate, burst)
+        # Optional FixtureStore recording every response body
+        self.recorder = None
+        # Optional base url of a stand-in server answering for cdws_host
+        self.replay_url = None
+
+    def cache_paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        path = os.path.join(http_cache_dir, key)
+        return f"{path}.json", f"{path}.body"
+
+    def load_cached(self, url):
+        meta_path, body_path = self.cache_paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                validators = json.load(f)
+            with open(body_path, "rb") as f:
+                return validators, f.read()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None, None
+
+    def store_cached(self, url, response):
+        validators = {
+            key: response.headers[header]
+            for key, header in [("etag", "ETag"), ("last_modified", "Last-Modified")]
+            if header in response.headers
+        }
+        if not validators:
+            return
+
+        os.makedirs(http_cache_dir, exist_ok=True)
+        meta_path, body_path = self.cache_paths(url)
+        # Body first, the validators are only replaced once their body is
+        # complete, so an interrupted write never revalidates a partial body
+        replace_file(body_path, response.content)
+        replace_file(meta_path, json.dumps(validators).encode("utf-8"))
+
+    def send(self, url, params, headers):
+        # Repeat timeouts, connection errors and server errors with backoff
+        elapsed = 0.0
+        for attempt in range(max_retries + 1):
+            self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(
+                    url, params=params, headers=headers, timeout=timeout
+                )
+            except (requests.Timeout, requests.ConnectionError) as e:
+                elapsed += time.perf_counter() - start
+                if attempt == max_retries:
+                    raise
+                logging.warning(f"Request to {url} failed: {e}, retrying")
+            else:
+                elapsed += time.perf_counter() - start
+                if response.status_code < 500 or attempt == max_retries:
+                    return response, attempt, elapsed
+                logging.warning(
+                    f"Request to {url} failed with status code "
+                    f"{response.status_code}, retrying"
+                )
+            time.sleep(backoff_factor * 2**attempt)
+
+    def get(self, url, params=None, revalidate=False):
+        """Return the body of a GET request, raising for HTTP errors.
+
+        With revalidate the last response is kept on disk and only
+        downloaded again if the server reports a change.
+        """
+        if self.replay_url is not None and url.startswith(cdws_host):
+            url = self.replay_url.rstrip("/") + url[len(cdws_host) :]
+        full_url = requests.Request("GET", url, params=params).prepare().url
+        headers = {}
+        cached_body = None
+        if revalidate:
+            validators, cached_body = self.load_cached(full_url)
+            if validators:
+                if "etag" in validators:
+                    headers["If-None-Match"] = validators["etag"]
+                if "last_modified" in validators:
+                    headers["If-Modified-Since"] = validators["last_modified"]
+
+        response, retries, seconds = self.send(url, params, headers)
+        metrics.record_request(
+            full_url, response.status_code, len(response.content), seconds, retries
+        )
+
+        if response.status_code == 304 and cached_body is not None:
+            body = cached_body
+        else:
+            response.raise_for_status()  # Raise an exception for HTTP errors
+            if revalidate:
+                self.store_cached(full_url, response)
+            body = response.content
+
+        if self.recorder is not None:
+            self.recorder.record(full_url, body, response.headers.get("Content-Type"))
+        return body
+
+
+# Client shared by all modules, so connections and the rate limit are shared
+client = HttpClient()
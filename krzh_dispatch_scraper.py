@@ -1,12 +1,18 @@
-import requests
-from bs4 import BeautifulSoup
+import hashlib
 import json
 import logging
-import arrow
-from time import sleep
+from datetime import timedelta
+from time import time
 import re
 import traceback
 
+from cdws_parser import iter_dispatches, iter_vorlagen
+from cdws_sync import get_high_water_mark, iter_pages, set_high_water_mark
+from dispatch_store import DispatchStore
+from http_client import client
+from metrics import metrics
+from records import Dispatch, Vorlage, format_date, parse_date
+
 # Setup logging
 logger = logging.getLogger(__name__)
 
@@ -21,168 +27,257 @@ base_url_vorlagen = (
 )
 
 
-def get_date_and_latest_ablaufschritt(vorlagen_nr):
+# Cache of resolved vorlagen and how long its entries stay valid
+vorlagen_cache_file = "vorlagen_cache.json"
+vorlagen_cache_ttl = 24 * 60 * 60
+
+# Number of vorlagen resolved with a single request
+vorlagen_batch_size = 20
+
+# Weekly runs re-check the dispatches of this many days before the
+# high-water mark, re-published dispatches older than that are only noticed
+# by a backfill
+recheck_days = 28
+
+
+def load_vorlagen_cache():
+    try:
+        with open(vorlagen_cache_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_vorlagen_cache(cache):
+    with open(vorlagen_cache_file, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=4, ensure_ascii=False)
+
+
+def summarize_ablaufschritte(affairs):
+    rr_antrag_date = None
+    # Initialize a dictionary to hold ablaufschritttyp and their respective dates
+    date_dict = {}
+
+    for affair in affairs:
+        for step in affair["steps"]:
+            # Extract the date from the first Antrag Regierungsrat section
+            if step["type"] == "Antrag Regierungsrat" and rr_antrag_date is None:
+                rr_antrag_date = step["date"]
+
+            step_date = parse_date(step["date"])
+            if step_date is not None and step["type"] is not None:
+                date_dict[step["type"]] = step_date
+
+    if not date_dict:
+        return rr_antrag_date, None, None
+
+    # Find the ablaufschritttyp with the latest date
+    latest_ablaufschritttyp = max(date_dict, key=date_dict.get)
+    latest_date = format_date(date_dict[latest_ablaufschritttyp])
+
+    return rr_antrag_date, latest_ablaufschritttyp, latest_date
+
+
+def fetch_vorlagen(vorlagen_nrs):
     # Parameters
     params_vorlagen = {
-        "q": f"vorlagennr any {vorlagen_nr} sortby beginn_start/sort.descending",
+        "q": f'vorlagennr any "{" ".join(vorlagen_nrs)}" sortby beginn_start/sort.descending',
         # Number of fetched entries, max is 1k
-        "m": "300",
+        "m": "1000",
         # Language
         "l": "de-CH",
     }
 
     # Make a request
-    response = requests.get(base_url_vorlagen, params=params_vorlagen)
-    response.raise_for_status()  # Raise an exception for HTTP errors
+    content = client.get(base_url_vorlagen, params=params_vorlagen)
 
-    # Parse the XML with BeautifulSoup
-    soup = BeautifulSoup(response.content, "lxml")
+    # Group the top-level affairs by their vorlagen_nr
+    affairs_by_nr = {}
+    with metrics.timer("xml_parse_seconds"):
+        for affair in iter_vorlagen(content):
+            affairs_by_nr.setdefault(affair["vorlagen_nr"], []).append(affair)
 
-    # Find the Ablaufschritt section with Antrag Regierungsrat
-    rr_antrag_section = soup.find(
-        "ablaufschritttyp", string="Antrag Regierungsrat"
-    ).find_parent()
+    return {
+        vorlagen_nr: summarize_ablaufschritte(affairs_by_nr[vorlagen_nr])
+        for vorlagen_nr in vorlagen_nrs
+        if vorlagen_nr in affairs_by_nr
+    }
 
-    # Extract the date from the Antrag Regierungsrat section
-    date_tag = rr_antrag_section.find("text")
-    rr_antrag_date = date_tag.text if date_tag else None
 
-    # Initialize a dictionary to hold ablaufschritttyp and their respective dates
-    date_dict = {}
+def resolve_vorlagen(vorlagen_nrs):
+    # Returns {vorlagen_nr: (rr_antrag_date, latest_step, latest_step_date)}
+    cache = load_vorlagen_cache()
+    now = time()
+    resolved = {}
+    missing = []
 
-    # Loop through all ablaufschritt sections
-    for ablaufschritt in soup.find_all("ablaufschritt"):
-        date_tag = ablaufschritt.find("text")
-        if date_tag:
-            date_str = date_tag.text
-            # Convert the date string to an arrow object for comparison
-            date_obj = arrow.get(date_str, "DD.MM.YYYY")  # Adjust format if needed
-            ablaufschritttyp_tag = ablaufschritt.find("ablaufschritttyp")
-            if ablaufschritttyp_tag:
-                date_dict[ablaufschritttyp_tag.text] = date_obj
+    for vorlagen_nr in dict.fromkeys(vorlagen_nrs):
+        cached = cache.get(vorlagen_nr)
+        if cached and now - cached["fetched"] < vorlagen_cache_ttl:
+            resolved[vorlagen_nr] = (
+                cached["RR_Antrag"],
+                cached["latest_step"],
+                cached["latest_step_date"],
+            )
+        else:
+            missing.append(vorlagen_nr)
 
-    # Find the ablaufschritttyp with the latest date
-    latest_ablaufschritttyp = max(date_dict, key=date_dict.get)
-    latest_date = date_dict[latest_ablaufschritttyp].format("DD.MM.YYYY")
+    # Fetch the remaining vorlagen in batches
+    for i in range(0, len(missing), vorlagen_batch_size):
+        batch = missing[i : i + vorlagen_batch_size]
+        for vorlagen_nr, result in fetch_vorlagen(batch).items():
+            resolved[vorlagen_nr] = result
+            cache[vorlagen_nr] = {
+                "fetched": now,
+                "RR_Antrag": result[0],
+                "latest_step": result[1],
+                "latest_step_date": result[2],
+            }
+        save_vorlagen_cache(cache)
 
-    return rr_antrag_date, latest_ablaufschritttyp, latest_date
+    for vorlagen_nr in missing:
+        if vorlagen_nr not in resolved:
+            logging.error(f"No affair found for VorlagenNr {vorlagen_nr}")
+
+    return resolved
+
+
+def get_date_and_latest_ablaufschritt(vorlagen_nr):
+    return resolve_vorlagen([vorlagen_nr]).get(vorlagen_nr, (None, None, None))
+
+
+def dispatch_query(since=None):
+    if since is None:
+        # Entries younger than 2040-01-01 to catch latest entries
+        condition = 'datum_start < "2040-01-01 00:00:00"'
+    else:
+        # Only entries from the high-water mark on
+        condition = f'datum_start >= "{since} 00:00:00"'
+    return f"{condition} sortBy datum_start/sort.descending"
+
+
+def dispatch_hash(dispatch):
+    # Hash of the parsed dispatch, changes when a dispatch is re-published
+    serialized = json.dumps(dispatch, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
 
 
 # Main function to scrape data from the krzh dispatch
-def krzh_dispatch():
+def krzh_dispatch(backfill=False):
+    # Date ("YYYY-MM-DD") and content hash of the scraped entries by GUID
+    with DispatchStore() as store:
+        stored_mails = store.dispatch_index()
+
+    # Weekly runs only fetch the delta since shortly before the last stored
+    # dispatch, a backfill walks the full history and fills the gaps
+    since = None
+    high_water_mark = parse_date(get_high_water_mark("KRVERSAND"))
+    if stored_mails and high_water_mark is not None and not backfill:
+        since = (high_water_mark - timedelta(days=recheck_days)).isoformat()
+
     # Parameters for the API call
     params_dispatch = {
-        # Entries younger than 2040-01-01 to catch latest entries
-        "q": 'datum_start < "2040-01-01 00:00:00" sortBy datum_start/sort.descending',
-        # Number of fetched entries, max is 1k
-        "m": "300",
+        "q": dispatch_query(since),
         # Language
         "l": "de-CH",
     }
 
-    # Load already scraped entries
-    try:
-        with open("krzh_dispatch_data.json", "r") as f:
-            existing_data = json.load(f)
-            stored_mails = [
-                arrow.get(entry["Datum KR-Versand"], "DD.MM.YYYY")
-                for entry in existing_data
-            ]
-    # If the entry doesn't exist, create an empty list
-    except FileNotFoundError:
-        existing_data = []
-        stored_mails = []
-
-    def parse_and_download(xml_data):
-        soup = BeautifulSoup(xml_data, "lxml-xml")
-        # Find all krzh entries, each entry contains multiple affairs
-        dispatchs = soup.find_all("KRVersand")
+    def parse_and_download(dispatches):
         krversand_data = []
 
-        for dispatch in dispatchs:
+        # Stream through all krzh entries, each entry contains multiple affairs
+        for dispatch in dispatches:
             # Get the date of the dispatch
-            krversand_date = arrow.get(
-                dispatch.Datum.contents[-1].text,
-                ["YYYY-MM-DD", "DD.MM.YYYY", "YYYYMMDD"],
-            )
-
-            # Skip if the entry already exists
-            if krversand_date in stored_mails:
+            krversand_date = parse_date(dispatch["date"])
+            if krversand_date is None:
+                logging.error(f"Error parsing the date of KR-Versand {dispatch['id']}")
                 continue
 
-            # Get all affairs from the dispatch, find_all is case sensitive
-            affairs = [
-                geschaeft
-                for geschaeft in dispatch.find_all("Geschaeft")
-                if geschaeft.find("Geschaeft") is not None
-            ]
+            identity = (dispatch["id"], dispatch_hash(dispatch))
+            stored = stored_mails.get(dispatch["id"])
+
+            # Unchanged, dispatches of the same day are told apart by GUID.
+            # Without a window every entry from here on is stored
+            if stored == (krversand_date.isoformat(), identity[1]):
+                if backfill or since is not None:
+                    continue
+                break
+            if stored is not None:
+                # Re-published with other content, update the stored entry
+                logging.info(f"KR-Versand of {format_date(krversand_date)} changed")
+                metrics.count("dispatches_changed")
 
             entries = []
             # Loop through all affairs
-            for affair in affairs:
-                affair_type = affair.Geschaeftsart.text
-                title = affair.Titel.text
-                position = affair.parent
+            for affair in dispatch["affairs"]:
+                affair_type = affair["affair_type"]
+                title = affair["title"]
 
                 # Skip if the affair is not a revision in law
                 if re.search(r"vorlage", affair_type.lower()) and re.search(
                     r"gesetz", title.lower()
                 ):
                     # Get the vorlage_nr
-                    vorlage_nr = affair.VorlagenNr.text
+                    vorlage_nr = affair["vorlage_nr"]
                     # Get the last document and its last version
-                    documents = position.find_all("Dokument")
-                    try:
-                        last_document = documents[0]
-                        edoc_id = last_document.eDocument["ID"]
-                        versions = last_document.find_all("Version")
-                        last_version = versions[-1]["Nr"]
-                    except Exception as e:
-                        logging.error(f"Error getting edoc_id or last_version: {e}")
+                    edoc_id = affair["edoc_id"]
+                    last_version = affair["last_version"]
+                    if edoc_id is None:
+                        logging.error(
+                            f"Error getting edoc_id or last_version of {vorlage_nr}"
+                        )
                         continue
 
                     # Construct the pdf url
                     pdf_url = f"https://parlzhcdws.cmicloud.ch/parlzh1/cdws/Files/{edoc_id}/{last_version}/pdf"
 
-                    (
-                        rr_date,
-                        latest_step,
-                        latest_step_date,
-                    ) = get_date_and_latest_ablaufschritt(vorlage_nr)
-
-                    # Append the data to the entries list
-                    data = {
-                        "Geschäftstitel": title,
-                        "Geschäftsart": affair_type,
-                        "PDF_URL": pdf_url,
-                        "VorlagenNr": vorlage_nr,
-                        "RR_Antrag": rr_date,
-                        "latest_step": latest_step,
-                        "latest_step_date": latest_step_date,
-                    }
-                    entries.append(data)
+                    # Append the data to the entries list, the procedural
+                    # steps are resolved for all vorlagen at once below
+                    entries.append(
+                        Vorlage(
+                            title=title,
+                            affair_type=affair_type,
+                            pdf_url=pdf_url,
+                            vorlagen_nr=vorlage_nr,
+                        )
+                    )
 
             # Append the data to the krversand_data list
-            krversand_dict = {
-                "Datum KR-Versand": krversand_date.format("DD.MM.YYYY"),
-                "Vorlagen": entries,
-            }
-            krversand_data.append(krversand_dict)
+            krversand_data.append(
+                Dispatch(
+                    date=krversand_date,
+                    vorlagen=entries,
+                    guid=identity[0],
+                    content_hash=identity[1],
+                )
+            )
+
+        # Resolve the procedural steps of all new vorlagen in a few requests
+        new_vorlagen = [vorlage for item in krversand_data for vorlage in item.vorlagen]
+        resolved = resolve_vorlagen([vorlage.vorlagen_nr for vorlage in new_vorlagen])
+        for vorlage in new_vorlagen:
+            rr_antrag, latest_step, latest_step_date = resolved.get(
+                vorlage.vorlagen_nr, (None, None, None)
+            )
+            vorlage.rr_antrag = parse_date(rr_antrag)
+            vorlage.latest_step = latest_step
+            vorlage.latest_step_date = parse_date(latest_step_date)
+
+        # Upsert only the new dispatches
+        with DispatchStore() as store:
+            for item in krversand_data:
+                store.add_dispatch(item)
+            latest = store.latest_date()
 
-        # Prepend the new data to the existing data
-        for item in reversed(krversand_data):
-            existing_data.insert(0, item)
-        with open("krzh_dispatch_data.json", "w", encoding="utf-8") as f:
-            json.dump(existing_data, f, indent=4, ensure_ascii=False)
+        # Remember the latest stored dispatch for the next delta sync
+        if latest is not None:
+            set_high_water_mark("KRVERSAND", latest)
 
     try:
-        response = requests.get(base_url_dispatch, params=params_dispatch)
-        sleep(3)
-        if response.status_code == 200:
-            logging.info(f"API call successful. Parsing and downloading PDFs.")
-            parse_and_download(response.content)
-        else:
-            logging.error(f"API call failed with status code {response.status_code}")
+        logging.info(f"Syncing Ratsversand since {since or 'the beginning'}")
+        parse_and_download(
+            iter_pages(base_url_dispatch, params_dispatch, iter_dispatches)
+        )
     except Exception as e:
         logging.error(f"Error during API call: {e}\n{traceback.format_exc()}")
 
@@ -1,105 +1,192 @@
-import requests
-from bs4 import BeautifulSoup
-from time import sleep
 import json
 import logging
-import arrow
+from datetime import date, timedelta
+
+from cdws_parser import iter_affair_trees
+from cdws_sync import get_high_water_mark, iter_pages, set_high_water_mark
+from records import Initiative, parse_date, read_json, write_json
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
 
+# CDWS only searches affairs by their start, not by the date of their
+# steps. Delta syncs re-read the affairs started this many days before the
+# high-water mark. Decisions on older affairs are picked up by a full pass
+# over all affairs, run once the last one is full_sync_days old
+lookback_days = 90
+full_sync_days = 28
+
+# File of all scraped entries and of the entries new or changed in the last run
+data_file = "krzh_initiatives_data.json"
+delta_file = "krzh_initiatives_delta.json"
+
+# Steps that make an entry, compared in lower case
+decision_actions = {
+    "zustimmung",
+    "ablehnung",
+    "vorläufig unterstützt",
+    "rückzug",
+    "antrag kommission",
+}
+
+
+def initiatives_query(since=None):
+    # Only return certain types of affairs
+    condition = 'geschaeftsart any "parlamentarische initiative einzelinitiative behördeninitiative"'
+    if since is not None:
+        condition += f' and beginn_start >= "{since} 00:00:00"'
+    return f"{condition} sortBy beginn_start/sort.descending"
+
+
+def merge_entries(existing_entries, entries, keep_existing=True):
+    """Merge the scraped Initiatives into the stored ones.
+
+    Returns the merged entries and the delta of entries that are new or
+    changed compared to the stored ones.
+    """
+    existing = {entry.key: entry for entry in existing_entries}
+    merged = {}
+    delta = {"new": [], "changed": []}
+    for entry in entries:
+        key = entry.key
+        if key in merged:
+            continue
+        merged[key] = entry
+        if key not in existing:
+            delta["new"].append(entry)
+        elif existing[key] != entry:
+            delta["changed"].append(entry)
+
+    # Keep stored entries the new window did not return again
+    if keep_existing:
+        for key, entry in existing.items():
+            merged.setdefault(key, entry)
+    return list(merged.values()), delta
+
+
 # Main function to scrape data from the krzh dispatch
-def krzh_initiatives():
+def krzh_initiatives(backfill=False, lookback_days=lookback_days):
     # Base ufl from opendata.swiss
     base_url = (
         "https://parlzhcdws.cmicloud.ch/parlzh5/cdws/Index/GESCHAEFT/searchdetails"
     )
 
+    # Load already scraped entries, a backfill rebuilds them from scratch
+    # but still reports its delta against them
+    existing_entries = []
+    try:
+        existing_entries = [
+            Initiative.from_legacy(entry) for entry in read_json(data_file)
+        ]
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    # Weekly runs only fetch the affairs started shortly before the
+    # high-water mark, a backfill and the periodic full pass walk the full
+    # history
+    since = None
+    high_water_mark = parse_date(get_high_water_mark("GESCHAEFT"))
+    last_full_sync = parse_date(get_high_water_mark("GESCHAEFT_FULL"))
+    full_sync_due = (
+        last_full_sync is None
+        or date.today() - last_full_sync >= timedelta(days=full_sync_days)
+    )
+    if existing_entries and high_water_mark is not None and not backfill:
+        if not full_sync_due:
+            since = (high_water_mark - timedelta(days=lookback_days)).isoformat()
+
     # Parameters for the API call
     params = {
-        # Only return certain types of affairs
-        "q": 'geschaeftsart any "parlamentarische initiative einzelinitiative behördeninitiative" sortBy beginn_start/sort.descending',
+        "q": initiatives_query(since),
         "l": "de-CH",
-        "s": "1",
-        # Number of fetched entries, max is 1k
-        "m": "300",
     }
 
     # Get the data from the API
-    def parse_and_download(xml_data):
-        soup = BeautifulSoup(xml_data, "lxml-xml")
-        affairs = soup.find_all("Geschaeft")
+    def parse_and_download(trees):
         entries = []
+        latest_start = None
+
+        # Stream through all affairs
+        for tree in trees:
+            # Track the latest start of the top-level affairs
+            start = parse_date(tree[0]["start"])
+            if start is not None:
+                latest_start = max(latest_start or start, start)
 
-        # Loop through all affairs
-        for affair in affairs:
-            legislative_steps = affair.find_all("AblaufschrittTyp")
-            # Skip if there are no legislative steps
-            if len(legislative_steps) == 0:
-                continue
-            for legislative_step in legislative_steps:
-                action = legislative_step.text
-                # Only add the entry if the action is a certain type
-                if action.lower() in [
-                    "zustimmung",
-                    "ablehnung",
-                    "vorläufig unterstützt",
-                    "rückzug",
-                    "Antrag Kommission",
-                ]:
-                    decision_parent = legislative_step.parent
-                    vorlage_nr = affair.KRNr.text
-                    vorlage_type = affair.Geschaeftsart.text
-                    vorlage_title = affair.Titel.text
-
-                    if decision_parent.StatusText is not None:
-                        decision_abstract = decision_parent.StatusText.text
-                    else:
-                        decision_abstract = None
-                    decision_date = arrow.get(
-                        decision_parent.Sitzungsdatum.contents[-1].text,
-                        ["YYYY-MM-DD", "DD.MM.YYYY", "YYYYMMDD"],
-                    ).format("YYYYMMDD")
-
-                    documents = affair.find_all("Dokument")
-                    try:
-                        last_document = documents[0]
-                        edoc_id = last_document.eDocument["ID"]
-                        versions = last_document.find_all("Version")
-                        last_version = versions[-1]["Nr"]
-                    except Exception as e:
-                        logging.error(f"Error getting edoc_id or last_version: {e}")
+            for affair in tree:
+                # Only add entries for steps of a certain type
+                decisions = [
+                    step
+                    for step in affair["steps"]
+                    if step["action"] and step["action"].lower() in decision_actions
+                ]
+                if not decisions:
+                    continue
+
+                # The document is the same for all steps of the affair
+                vorlage_nr = affair["krnr"]
+                edoc_id = affair["edoc_id"]
+                last_version = affair["last_version"]
+                if edoc_id is None:
+                    logging.error(
+                        f"Error getting edoc_id or last_version of {vorlage_nr}"
+                    )
+                    continue
+                pdf_url = f"https://parlzhcdws.cmicloud.ch/parlzh5/cdws/Files/{edoc_id}/{last_version}/pdf"
+
+                for legislative_step in decisions:
+                    decision_date = parse_date(legislative_step["date"])
+                    if decision_date is None:
+                        logging.error(
+                            f"Error parsing the date of {legislative_step['action']} "
+                            f"of {vorlage_nr}"
+                        )
                         continue
 
-                    pdf_url = f"https://parlzhcdws.cmicloud.ch/parlzh5/cdws/Files/{edoc_id}/{last_version}/pdf"
                     # Add the data to entries
-                    data = {
-                        "vorlage_type": vorlage_type,
-                        "vorlage_title": vorlage_title,
-                        "krnr": vorlage_nr,
-                        "decision": action,
-                        "decision_abstract": decision_abstract,
-                        "decision_date": decision_date.format("DD.MM.YYYY"),
-                        "pdf_url": pdf_url,
-                    }
-                    entries.append(data)
-
-        # Add the data to the JSON file
-        with open("krzh_initiatives_data.json", "w", encoding="utf-8") as f:
-            json.dump(entries, f, indent=4, ensure_ascii=False)
+                    entries.append(
+                        Initiative(
+                            vorlage_type=affair["vorlage_type"],
+                            vorlage_title=affair["vorlage_title"],
+                            krnr=vorlage_nr,
+                            decision=legislative_step["action"],
+                            decision_abstract=legislative_step["abstract"],
+                            decision_date=decision_date,
+                            pdf_url=pdf_url,
+                        )
+                    )
+
+        entries, delta = merge_entries(
+            existing_entries, entries, keep_existing=not backfill
+        )
+        logging.info(
+            f"Found {len(delta['new'])} new and {len(delta['changed'])} changed "
+            "Initiativen"
+        )
+
+        # Only rewrite the JSON file if an entry was added, changed or dropped
+        if entries != existing_entries:
+            write_json(data_file, [entry.to_legacy() for entry in entries])
+        write_json(
+            delta_file,
+            {
+                kind: [entry.to_legacy() for entry in changed]
+                for kind, changed in delta.items()
+            },
+        )
+
+        # Remember the latest affair for the next delta sync
+        if latest_start is not None:
+            set_high_water_mark("GESCHAEFT", latest_start.isoformat())
+        if since is None:
+            set_high_water_mark("GESCHAEFT_FULL", date.today().isoformat())
 
         return entries
 
     try:
-        response = requests.get(base_url, params=params)
-        sleep(3)
-        if response.status_code == 200:
-            logging.info(f"API call successful. Parsing and downloading PDFs.")
-            new_entries = parse_and_download(response.content)
-            return new_entries
-        else:
-            logging.error(f"API call failed with status code {response.status_code}")
+        logging.info(f"Syncing Initiativen since {since or 'the beginning'}")
+        return parse_and_download(iter_pages(base_url, params, iter_affair_trees))
     except Exception as e:
         logging.error(f"Error during API call: {e}")
 
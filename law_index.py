@@ -0,0 +1,169 @@
+import json
+import re
+
+from norms import natural_key, parse_norm
+from records import format_date, read_json, write_json
+from search_index import norm_pattern, umlaut_table
+
+# Reverse index from the laws changed by the vorlagen to the vorlagen
+law_index_file = "krzh_laws.json"
+
+# Date and abbreviation following the name, e.g. "vom 8. Juni 1997 (StG)"
+law_date_pattern = re.compile(r"\s+vom\s+\d{1,2}\.\s*\S+\s+\d{4}\b.*$", re.S)
+parenthesis_pattern = re.compile(r"\s*\([^)]*\)")
+article_pattern = re.compile(r"^(?:Das|Die|Der)\s+")
+# Titles of vorlagen name the changed law, e.g. "Änderung des Steuergesetzes"
+# or "Steuergesetz (StG), Änderung"
+amendment_pattern = re.compile(r"^Änderung\s+(?:des|der)\s+|,\s*Änderung\b.*$")
+genitive_pattern = re.compile(r"(?<=[Gg]esetz)es\b")
+
+
+def normalize_law(name):
+    """Return the name of a law without article, date and abbreviation."""
+    name = " ".join(name.split())
+    name = law_date_pattern.sub("", name)
+    name = parenthesis_pattern.sub("", name)
+    name = amendment_pattern.sub("", name)
+    name = genitive_pattern.sub("", name)
+    return article_pattern.sub("", name).strip(" ,.;:")
+
+
+def law_key(name):
+    # File name safe key, names differing only in case or umlauts match
+    key = normalize_law(name).lower().translate(umlaut_table)
+    return re.sub(r"[^a-z0-9]+", "-", key).strip("-")
+
+
+def paragraphs_of(norm):
+    # "§ 12a Abs. 2 lit. b" belongs to "§ 12a", "§§ 14 bis 16" to "§ 14",
+    # "§ 15" and "§ 16", placeholders to none
+    match = norm_pattern.match(norm)
+    if not match or not int(match.group(1)):
+        return []
+    first, first_suffix = int(match.group(1)), match.group(2) or ""
+    if not match.group(3):
+        return [f"§ {first}{first_suffix}"]
+    last, last_suffix = int(match.group(3)), match.group(4) or ""
+    if first_suffix or last_suffix or last <= first:
+        # Only the ends of the range are known
+        return [f"§ {first}{first_suffix}", f"§ {last}{last_suffix}"]
+    return [f"§ {paragraph}" for paragraph in range(first, last + 1)]
+
+
+def sorted_paragraphs(paragraphs):
+    return sorted(set(paragraphs), key=lambda text: natural_key(parse_norm(text)))
+
+
+def vorlage_laws(vorlage):
+    """Return {law key: {"name", "paragraphs"}} of the laws a vorlage changes.
+
+    The primary norms belong to the law named in the title of the vorlage,
+    the secondary norms name their law unless they are a plain list.
+    """
+    norms_by_law = []
+    if vorlage.title and vorlage.primary_norms:
+        norms_by_law.append((vorlage.title, vorlage.primary_norms))
+    if isinstance(vorlage.secondary_norms, dict):
+        norms_by_law += vorlage.secondary_norms.items()
+
+    laws = {}
+    for name, norms in norms_by_law:
+        key = law_key(name)
+        paragraphs = [
+            paragraph
+            for norm in norms
+            if isinstance(norm, str)
+            for paragraph in paragraphs_of(norm)
+        ]
+        if not key or not paragraphs:
+            continue
+        law = laws.setdefault(key, {"name": normalize_law(name), "paragraphs": []})
+        law["paragraphs"] = sorted_paragraphs(law["paragraphs"] + paragraphs)
+    return laws
+
+
+def law_entries(dispatches):
+    """Return {vorlage key: entry} of all extracted vorlagen of the dispatches."""
+    entries = {}
+    for dispatch in dispatches:
+        for vorlage in dispatch.vorlagen:
+            if vorlage.text_key is None:
+                continue
+            laws = vorlage_laws(vorlage)
+            if not laws:
+                continue
+            key = (
+                f"{dispatch.date.isoformat()}/{vorlage.vorlagen_nr or vorlage.pdf_url}"
+            )
+            entries[key] = {
+                "date": format_date(dispatch.date),
+                "nr": vorlage.vorlagen_nr,
+                "title": vorlage.title,
+                "pdf": vorlage.pdf_url,
+                "latest_step": vorlage.latest_step,
+                "latest_step_date": format_date(vorlage.latest_step_date),
+                "laws": laws,
+            }
+    return entries
+
+
+class LawIndex:
+    """Laws with their changed paragraphs and the vorlagen changing them.
+
+    The file holds "vorlagen", each with the laws and paragraphs it
+    changes, and "laws", each with its name and the keys of the vorlagen
+    per paragraph, newest first. update() only rebuilds the laws of
+    vorlagen that were added, changed or removed since the last update.
+    """
+
+    def __init__(self, path=law_index_file):
+        self.path = path
+        try:
+            data = read_json(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        self.vorlagen = data.get("vorlagen", {})
+        self.laws = data.get("laws", {})
+
+    def update(self, entries):
+        """Take over the entries of law_entries(), return the affected law keys."""
+        affected = set()
+        for key in self.vorlagen.keys() | entries.keys():
+            old, new = self.vorlagen.get(key), entries.get(key)
+            if old != new:
+                for entry in (old, new):
+                    affected.update(entry["laws"] if entry else [])
+        self.vorlagen = entries
+
+        # Newest first, the keys start with the date of the dispatch
+        rebuilt = {}
+        for key in sorted(entries, reverse=True):
+            for law, changes in entries[key]["laws"].items():
+                if law not in affected:
+                    continue
+                record = rebuilt.setdefault(
+                    law, {"name": changes["name"], "paragraphs": {}}
+                )
+                for paragraph in changes["paragraphs"]:
+                    record["paragraphs"].setdefault(paragraph, []).append(key)
+
+        for law in affected:
+            if law in rebuilt:
+                paragraphs = rebuilt[law]["paragraphs"]
+                rebuilt[law]["paragraphs"] = {
+                    paragraph: paragraphs[paragraph]
+                    for paragraph in sorted_paragraphs(paragraphs)
+                }
+                self.laws[law] = rebuilt[law]
+            else:
+                self.laws.pop(law, None)
+        return affected
+
+    def save(self):
+        write_json(
+            self.path,
+            {
+                "laws": dict(sorted(self.laws.items())),
+                "vorlagen": dict(sorted(self.vorlagen.items(), reverse=True)),
+            },
+        )
@@ -1,9 +1,23 @@
+import argparse
+import hashlib
+import json
 import logging
+import os
+import threading
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 
 from krzh_dispatch_scraper import krzh_dispatch
 from krzh_initiatives_scraper import krzh_initiatives
 from pdf_reader import pdf_reader
-from generate_page import generate_page
+from generate_page import cutoff_key, generate_law_pages, generate_page
+from dispatch_store import DispatchStore, database_file, json_file
+from law_index import law_index_file
+from metrics import metrics, profiled
+from http_client import TokenBucket, burst_size, client
+from cdws_fixtures import FixtureStore
 
 logging.basicConfig(
     filename="log.log",
@@ -12,32 +26,223 @@ logging.basicConfig(
     datefmt="%m/%d/%Y %I:%M:%S %p",
 )
 
+# Fingerprints of the inputs of each stage after its last successful run
+stage_state_file = "stage_state.json"
 
-def main():
+
+def export_dispatch_json():
+    with DispatchStore() as store:
+        store.export_json()
+
+
+def generate_dispatch_page():
+    generate_page(
+        database_file,
+        "KRZH - Vorlagen Ratsversand",
+        "krzh_dispatch",
+        archive=True,
+        compress=("gzip",),
+        search=True,
+    )
+
+
+def generate_law_index():
+    generate_law_pages(compress=("gzip",))
+
+
+def generate_initiatives_page():
+    generate_page(
+        "krzh_initiatives_data.json",
+        "KRZH - Initiativen",
+        "krzh_initiatives",
+        archive=True,
+        compress=("gzip",),
+    )
+
+
+def file_state(*paths):
+    # Size and modification time of each file, None for missing files
+    state = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            state.append([path, None])
+        else:
+            state.append([path, stat.st_size, stat.st_mtime_ns])
+    return state
+
+
+def page_inputs(data_file, htmlname):
+    # Pages also change with the renderer and when items fall out of the
+    # last year, a missing or edited page is written again
+    return [
+        cutoff_key(),
+        file_state(
+            data_file, "generate_page.py", "search_index.py", f"{htmlname}.html"
+        ),
+    ]
+
+
+# Stages of a run with their log message, the stages they need to run after
+# and a function returning their inputs. Stages without inputs always run,
+# the others are skipped if their inputs did not change since their last run
+Stage = namedtuple("Stage", ["name", "description", "run", "after", "inputs"])
+
+stages = [
+    Stage("krzh_dispatch", "scraping Ratsversand", krzh_dispatch, [], None),
+    Stage("krzh_initiatives", "scraping Initiativen", krzh_initiatives, [], None),
+    Stage("pdf_reader", "reading PDFs", pdf_reader, ["krzh_dispatch"], None),
+    Stage(
+        "export_json",
+        "exporting krzh_dispatch_data.json",
+        export_dispatch_json,
+        ["pdf_reader"],
+        lambda: file_state(database_file, json_file),
+    ),
+    Stage(
+        "generate_dispatch_page",
+        "generating page for KRZH - Vorlagen Ratsversand",
+        generate_dispatch_page,
+        ["pdf_reader"],
+        lambda: page_inputs(database_file, "krzh_dispatch"),
+    ),
+    Stage(
+        "generate_law_pages",
+        "generating pages of the changed laws",
+        generate_law_index,
+        ["pdf_reader"],
+        lambda: file_state(
+            database_file, law_index_file, "law_index.py", "generate_page.py"
+        ),
+    ),
+    Stage(
+        "generate_initiatives_page",
+        "generating page for KRZH - Initiativen",
+        generate_initiatives_page,
+        ["krzh_initiatives"],
+        lambda: page_inputs("krzh_initiatives_data.json", "krzh_initiatives"),
+    ),
+]
+
+
+def load_stage_state():
     try:
-        logging.info("Starting scraping Ratsversand")
-        krzh_dispatch()
-        ###
-        logging.info("Starting scraping Initiativen")
-        krzh_initiatives()
-        ###
-        logging.info("Starting reading PDFs")
-        pdf_reader()
-        ###
-        logging.info("Starting generating page for KRZH - Vorlagen Ratsversand")
-        generate_page(
-            "krzh_dispatch_data.json", "KRZH - Vorlagen Ratsversand", "krzh_dispatch"
-        )
-        logging.info("Page for KRZH - Vorlagen Ratsversand generated successfully")
-        ###
-        logging.info("Starting generating page for KRZH - Initiativen")
-        generate_page(
-            "krzh_initiatives_data.json", "KRZH - Initiativen", "krzh_initiatives"
+        with open(stage_state_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def fingerprint(inputs):
+    serialized = json.dumps(inputs, sort_keys=True)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def run_stages(stages, profile_stage=None, profiler="cprofile", force=False):
+    """Run the stages, each as soon as the stages it depends on are done.
+
+    A failing stage only stops the stages depending on it. Returns the
+    status of each stage: "done", "unchanged", "failed" or "blocked".
+    """
+    state = load_stage_state()
+    state_lock = threading.Lock()
+    futures = {}
+
+    def run_stage(stage):
+        # Stages are submitted in order, so their dependencies already are
+        if any(
+            futures[name].result() not in ("done", "unchanged") for name in stage.after
+        ):
+            logging.error(f"Skipping {stage.description}, a stage it needs failed")
+            return "blocked"
+
+        if (
+            stage.inputs is not None
+            and not force
+            and state.get(stage.name) == fingerprint(stage.inputs())
+        ):
+            logging.info(f"Skipping {stage.description}, its inputs did not change")
+            metrics.count("stage_skipped", stage=stage.name)
+            return "unchanged"
+
+        logging.info(f"Starting {stage.description}")
+        # Optionally profile a single stage
+        profile = (
+            profiled(stage.name, profiler)
+            if stage.name == profile_stage
+            else nullcontext()
         )
-        logging.info("Page for KRZH - Initiativen generated successfully")
+        try:
+            with metrics.stage(stage.name), profile:
+                stage.run()
+        except Exception as e:
+            logging.error(
+                f"Error during {stage.description}: {e}\n{traceback.format_exc()}"
+            )
+            return "failed"
+        logging.info(f"Finished {stage.description}")
+
+        # Remember the inputs as the stage left them
+        if stage.inputs is not None:
+            with state_lock:
+                state[stage.name] = fingerprint(stage.inputs())
+                with open(stage_state_file, "w", encoding="utf-8") as f:
+                    json.dump(state, f, indent=4)
+        return "done"
+
+    # One thread per stage, so a stage waiting for another never blocks one
+    # that could run
+    with ThreadPoolExecutor(len(stages)) as executor:
+        for stage in stages:
+            futures[stage.name] = executor.submit(run_stage, stage)
+    return {name: future.result() for name, future in futures.items()}
+
+
+def main(profile_stage=None, profiler="cprofile", force=False):
+    try:
+        statuses = run_stages(stages, profile_stage, profiler, force)
+        logging.info(f"Stages: {statuses}")
     except Exception as e:
         logging.error(f"Error during main(): {e}")
+    finally:
+        # Write the run report even if a stage failed
+        metrics.write()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile",
+        choices=[stage.name for stage in stages],
+        help="profile the thread running the given stage, without the download "
+        "threads and extraction processes it starts",
+    )
+    parser.add_argument(
+        "--profiler", choices=["cprofile", "pyinstrument"], default="cprofile"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="run all stages, even if their inputs did not change",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="DIR",
+        help="record all CDWS responses into DIR for cdws_server.py",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="URL",
+        help="send all CDWS requests to a stand-in server, e.g. cdws_server.py",
+    )
+    parser.add_argument("--rate", type=float, help="CDWS requests per second")
+    args = parser.parse_args()
+
+    if args.record:
+        client.recorder = FixtureStore(args.record)
+    if args.replay:
+        client.replay_url = args.replay
+    if args.rate:
+        client.bucket = TokenBucket(args.rate, burst_size)
+    main(args.profile, args.profiler, args.force)
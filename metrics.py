@@ -0,0 +1,182 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Machine-readable reports of the last run
+report_file = "run_report.json"
+prometheus_file = "run_report.prom"
+
+# Stage of the running code, stages running in parallel threads each
+# see their own
+stage_var = ContextVar("stage", default=None)
+
+# Prefix of all exported Prometheus metrics
+metric_prefix = "krzh"
+
+# Help texts of the exported counters
+metric_help = {
+    "stage_seconds": "Wall-clock time spent in a stage",
+    "stage_failures": "Stages that raised an exception",
+    "stage_skipped": "Stages skipped as their inputs did not change",
+    "http_requests": "HTTP requests sent",
+    "http_bytes": "Bytes received over HTTP",
+    "http_seconds": "Time spent waiting for HTTP responses",
+    "http_retries": "HTTP requests repeated after a failure",
+    "xml_parse_seconds": "Time spent parsing CDWS responses",
+    "xml_records": "Records parsed from CDWS responses",
+    "pdf_files": "PDFs extracted",
+    "pdf_pages": "PDF pages extracted",
+    "pdf_bytes": "Bytes of the extracted PDFs",
+    "pdf_seconds": "Time spent extracting PDFs in the worker processes",
+}
+
+
+class Metrics:
+    """Timers and counters of a run, labelled with the stage they belong to."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.requests = []
+        self.pdfs = []
+        self.started = time.time()
+
+    @property
+    def current_stage(self):
+        return stage_var.get()
+
+    def count(self, name, value=1, stage=None):
+        with self.lock:
+            self.counters[(name, stage or self.current_stage)] += value
+
+    @contextmanager
+    def timer(self, name, stage=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(name, time.perf_counter() - start, stage)
+
+    @contextmanager
+    def stage(self, name):
+        # Everything recorded inside the block is labelled with the stage
+        token = stage_var.set(name)
+        try:
+            with self.timer("stage_seconds"):
+                yield
+        except BaseException:
+            self.count("stage_failures")
+            raise
+        finally:
+            stage_var.reset(token)
+
+    def record_request(self, url, status, size, seconds, retries=0):
+        self.count("http_requests")
+        self.count("http_bytes", size)
+        self.count("http_seconds", seconds)
+        self.count("http_retries", retries)
+        with self.lock:
+            self.requests.append(
+                {
+                    "stage": self.current_stage,
+                    "url": url,
+                    "status": status,
+                    "bytes": size,
+                    "seconds": round(seconds, 4),
+                    "retries": retries,
+                }
+            )
+
+    def record_pdf(self, url, pages, size, seconds):
+        self.count("pdf_files")
+        self.count("pdf_pages", pages)
+        self.count("pdf_bytes", size)
+        self.count("pdf_seconds", seconds)
+        with self.lock:
+            self.pdfs.append(
+                {
+                    "url": url,
+                    "pages": pages,
+                    "bytes": size,
+                    "seconds": round(seconds, 4),
+                }
+            )
+
+    def report(self):
+        counters = defaultdict(dict)
+        for (name, stage), value in sorted(
+            self.counters.items(), key=lambda item: (item[0][0], item[0][1] or "")
+        ):
+            counters[name][stage or "none"] = round(value, 4)
+        return {
+            "started": self.started,
+            "finished": time.time(),
+            "counters": dict(counters),
+            "requests": self.requests,
+            "pdfs": self.pdfs,
+        }
+
+    def prometheus(self):
+        # Textfile format as read by the node_exporter textfile collector
+        lines = [
+            f"# HELP {metric_prefix}_run_timestamp_seconds Start of the last run",
+            f"# TYPE {metric_prefix}_run_timestamp_seconds gauge",
+            f"{metric_prefix}_run_timestamp_seconds {self.started:.0f}",
+        ]
+        for name, values in self.report()["counters"].items():
+            metric = f"{metric_prefix}_{name}"
+            lines.append(f"# HELP {metric} {metric_help.get(name, name)}")
+            lines.append(f"# TYPE {metric} gauge")
+            for stage, value in values.items():
+                lines.append(f'{metric}{{stage="{stage}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path=report_file, prometheus_path=prometheus_file):
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=4, ensure_ascii=False)
+        with open(prometheus_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+
+
+# Metrics of the current run, shared by all modules
+metrics = Metrics()
+
+
+@contextmanager
+def profiled(name, profiler="cprofile"):
+    """Profile the block and write the result to profile_<name>.*.
+
+    Only the calling thread is profiled, not the threads and processes
+    the block starts.
+    """
+    if profiler == "pyinstrument":
+        # Optional dependency, only needed when asked for
+        from pyinstrument import Profiler
+
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(f"profile_{name}.html", "w", encoding="utf-8") as f:
+                f.write(profile.output_html())
+        return
+
+    import cProfile
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(f"profile_{name}.prof")
+        logging.info(f"Profile of {name} written to profile_{name}.prof")
@@ -0,0 +1,123 @@
+import re
+from collections import namedtuple
+
+# A norm runs from the § sign to the next period, e.g. "§ 12a."
+norms_pattern = re.compile(r"§.*?\.")
+
+# Paragraph number and optional letter suffix, e.g. "12a", "12 a", "12bis".
+# After a space "bis" must not start a range ("§§ 14 bis 16") and a letter
+# must not start a word ("§ 3 e contrario"). The pattern is also used by
+# search.js, so it has to stay valid in JavaScript
+suffix_pattern = r"(?:bis|ter|quater|[a-z])\b"
+spaced_suffix_pattern = (
+    r"(?:(?:bis|ter|quater)\b(?!\s*\d)"
+    r"|[a-z]\b(?=[^\w\s]|\s+(?:[A-ZÄÖÜ\d]|und\b|oder\b|bis\b|sowie\b)|\s*$))"
+)
+paragraph_pattern = re.compile(
+    rf"(\d+)(?:(?=[a-z])|\s(?={spaced_suffix_pattern}))?({suffix_pattern})?"
+)
+absatz_pattern = re.compile(r"Abs\.?\s*(\d+)")
+litera_pattern = re.compile(r"lit\.?\s*([a-z])\b")
+
+# Law name in front of "wird wie folgt geändert" and its numbering
+amended_law_marker = "wird wie folgt geändert"
+law_numbering_pattern = re.compile(r"^\s*[IVXLCDM]+\. Das ")
+
+# Laws amended in the Anhang of a Totalrevision are numbered "1.", "2.", ...
+annex_numbering_pattern = re.compile(r"^\s*(?:\d+\.\s*)?(?:Das|Die|Der) ")
+
+# Natural order of the suffixes, plain letters sort alphabetically after them
+suffix_order = {"": 0, "bis": 1, "ter": 2, "quater": 3}
+
+Norm = namedtuple("Norm", ["text", "paragraph", "suffix", "absatz", "litera"])
+
+
+def parse_norm(text):
+    """Split a norm like "§ 12a Abs. 2 lit. b" into its parts."""
+    paragraph = paragraph_pattern.search(text)
+    absatz = absatz_pattern.search(text)
+    litera = litera_pattern.search(text)
+    return Norm(
+        text=text,
+        paragraph=int(paragraph.group(1)) if paragraph else 0,
+        suffix=(paragraph.group(2) or "") if paragraph else "",
+        absatz=int(absatz.group(1)) if absatz else 0,
+        litera=litera.group(1) if litera else "",
+    )
+
+
+def natural_key(norm):
+    # § 12 < § 12bis < § 12a < § 12b < § 13
+    return (
+        norm.paragraph,
+        suffix_order.get(norm.suffix, len(suffix_order)),
+        norm.suffix,
+        norm.absatz,
+        norm.litera,
+        norm.text,
+    )
+
+
+def find_norms(text):
+    # Norm strings as shown on the page, without the closing period
+    return [match.group().rstrip(".") for match in norms_pattern.finditer(text)]
+
+
+def extract_primary_norms(text_dict):
+    # Norms at the start of each split page, deduplicated and in natural order
+    norms = {}
+    for text in text_dict.values():
+        for norm in find_norms(text[:20]):
+            if norm not in norms:
+                norms[norm] = parse_norm(norm)
+
+    return [norm.text for norm in sorted(norms.values(), key=natural_key)]
+
+
+def extract_secondary_norms(text_list):
+    laws_and_norms = {}
+    current_law_name = None
+
+    for text in text_list:
+        if amended_law_marker in text:
+            # This text defines the law name.
+            law_name_candidate = text.split(f" {amended_law_marker}")[0].strip()
+            # Remove the pattern "ROMAN NUMERAL SPACE Das SPACE"
+            current_law_name = law_numbering_pattern.sub("", law_name_candidate)
+
+        else:
+            # This might be the text with the norms.
+            norms_list = find_norms(text)
+
+            if norms_list and current_law_name:
+                # If norms were found, associate them with the current law.
+                laws_and_norms[current_law_name] = norms_list
+
+    return laws_and_norms
+
+
+def extract_annex_norms(text_list):
+    """Norms of the laws amended in the Anhang of a Totalrevision.
+
+    Unlike extract_secondary_norms() the norms of a law are collected over
+    all its text blocks, as an Anhang lists many amendments per law.
+    """
+    laws_and_norms = {}
+    current_law_name = None
+
+    for text in text_list:
+        if amended_law_marker in text:
+            law_name_candidate = text.split(f" {amended_law_marker}")[0].strip()
+            # Only keep the part after the intro of the Anhang
+            law_name_candidate = law_name_candidate.split(":")[-1].strip()
+            current_law_name = annex_numbering_pattern.sub("", law_name_candidate)
+            # Norms may follow the law name in the same block
+            text = text.split(amended_law_marker, 1)[1]
+
+        if current_law_name:
+            for norm in find_norms(text):
+                norms = laws_and_norms.setdefault(current_law_name, [])
+                if norm not in norms:
+                    norms.append(norm)
+
+    return laws_and_norms
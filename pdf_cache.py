@@ -0,0 +1,99 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Directory holding the cached PDFs
+cache_dir = "pdf_cache"
+
+# Size cap of the cache, least recently used PDFs are evicted beyond it
+max_cache_bytes = 2 * 1024**3
+
+# eDocument ID and version in a CDWS file url
+pdf_url_pattern = re.compile(r"/Files/([^/]+)/([^/]+)/pdf")
+
+
+def cache_key(pdf_url):
+    # An (edoc_id, version) pair never changes its content
+    match = pdf_url_pattern.search(pdf_url)
+    if match:
+        return match.group(1), match.group(2)
+    # Fall back to the url itself for anything not served by CDWS
+    return "url-" + hashlib.sha256(pdf_url.encode("utf-8")).hexdigest(), "0"
+
+
+@contextmanager
+def open_mapped(path):
+    # Memory-map the file read-only, pdfplumber reads it like a stream
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+class PdfCache:
+    """On-disk PDF cache keyed by eDocument ID and version."""
+
+    def __init__(self, directory=cache_dir, max_bytes=max_cache_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, edoc_id, version):
+        name = re.sub(r"[^\w.-]", "_", f"{edoc_id}_{version}")
+        return os.path.join(self.directory, f"{name}.pdf")
+
+    def get(self, edoc_id, version):
+        # Return the path of a cached PDF and mark it as recently used
+        path = self.path(edoc_id, version)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, edoc_id, version, data):
+        # Write to a temporary file first so readers never see partial PDFs
+        path = self.path(edoc_id, version)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".pdf"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        # Remove the least recently used PDFs until we are below the cap
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            logging.info(f"Evicted {path} from PDF cache")
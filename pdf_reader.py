@@ -1,21 +1,38 @@
+import contextvars
 import logging
+import os
 import re
+import threading
+import time
 import requests
-from time import sleep
 import pdfplumber
-import io
-import json
+from pdfplumber.utils import chars_to_textmap, crop_to_bbox
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from dispatch_store import DispatchStore, max_attempts
+from http_client import client
+from metrics import metrics
+from norms import extract_annex_norms, extract_primary_norms, extract_secondary_norms
+from pdf_cache import PdfCache, cache_key, open_mapped
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
-# Norms pattern
-norms_pattern = r"§.*?\."
+# Markers of the sections of a Vorlage
+roman_ii_pattern = re.compile(r"(?<![IVXLCDM])II\.(?![IVXLCDM])")
+totalrevision_marker = "Es wird folgendes Gesetz erlassen"
+annex_pattern = re.compile(r"Anhang\b")
+
+# Column detection of landscape Synopse PDFs, in points
+column_bin_width = 2
+min_gutter = 8
+max_columns = 3
 
 
 def check_totalrevision(original_pdf_data):
     for page_text in original_pdf_data.values():
-        if "Es wird folgendes Gesetz erlassen" in page_text:
+        if totalrevision_marker in page_text:
             return True
     return False
 
@@ -27,231 +44,388 @@ def remove_hyphens(text):
     return text
 
 
-def custom_sort(norm):
-    # Extract the number from the norm
-    match = re.search(r"\d+", norm)
-    if match:
-        return int(match.group())
-    return 0
-
-
-def extract_primary_norms(text_dict):
-    primary_norms = []
-
-    # Iterate over each item in the dictionary
-    for key, text in text_dict.items():
-        # Find all matches in the limited text
-        matches = re.findall(norms_pattern, text[:20])
-
-        # Strip the period after detection
-        stripped_matches = [match.rstrip(".") for match in matches]
-
-        primary_norms.extend(stripped_matches)
-
-        # Remove duplicates from the combined list
-        primary_norms = list(set(primary_norms))
-
-        # Sort using our custom sorting function
-        primary_norms = sorted(primary_norms, key=custom_sort)
-
-    return primary_norms
-
-
-def extract_secondary_norms(text_list):
-    laws_and_norms = {}
-    current_law_name = None
-
-    for text in text_list:
-        if "wird wie folgt geändert" in text:
-            # This text defines the law name.
-            law_name_candidate = text.split(" wird wie folgt geändert")[0].strip()
-            # Remove the pattern "ROMAN NUMERAL SPACE Das SPACE"
-            current_law_name = re.sub(r"^\s*[IVXLCDM]+\. Das ", "", law_name_candidate)
+def split_chars_on_gaps(chars, gap_threshold):
+    if not chars:
+        return [""]
 
-        else:
-            # This might be the text with the norms.
-            norms_list = re.findall(norms_pattern, text)
-            # Strip the period after detection
-            stripped_norms_list = [norm.rstrip(".") for norm in norms_list]
+    # Cluster the chars into lines once, the lines carry their text and extent
+    lines = chars_to_textmap(chars).extract_text_lines(strip=True, return_chars=False)
 
-            if stripped_norms_list and current_law_name:
-                # If norms were found, associate them with the current law.
-                laws_and_norms[current_law_name] = stripped_norms_list
+    # Start a new split page at every gap larger than the threshold
+    split_pages = [[]]
+    for i, line in enumerate(lines):
+        if i > 0 and line["top"] - lines[i - 1]["bottom"] > gap_threshold:
+            split_pages.append([])
+        split_pages[-1].append(line["text"])
 
-    return laws_and_norms
+    # Assemble the text of each split page from its lines
+    return ["\n".join(split_page) for split_page in split_pages]
 
 
-def split_page_on_gaps(pdf_page, gap_threshold):
-    # Get the bounding box of the entire page
-    x0, y0, x1, y1 = pdf_page.bbox
+def body_bounds(page):
+    # Top and bottom of the page without header and footer
+    return page.bbox[1] + (21.9 * 2.83465), page.bbox[3] - (22.6 * 2.83465)
 
-    # Get the lines on the page, sorted by their vertical position (top edge)
-    lines = pdf_page.extract_text_lines()
 
-    # Create a list to store the split pages
-    split_pages = []
+def iter_text_blocks_portrait(pdf, gap_threshold):
+    # Yield ((page, split page), text) lazily, a page is only parsed when
+    # the consumer asks for its text
+    for i, page in enumerate(pdf.pages):
+        # Calculate the crop dimensions based on the page number
+        if (i + 1) % 2 == 0:  # even pages
+            x0 = page.bbox[0] + 85
+            x1 = page.bbox[2]
+        else:  # odd pages
+            x0 = page.bbox[0]
+            x1 = page.bbox[2] - 85
 
-    # For each line, if the gap to the next line is larger than the threshold,
-    # split the page at that line
-    for i, line in enumerate(lines[:-1]):  # Exclude the last line
-        next_line = lines[i + 1]
-        gap = next_line["top"] - line["bottom"]
+        # Crop the header and footer
+        top, bottom = body_bounds(page)
 
-        if gap > gap_threshold:
-            split_point = line["bottom"] + gap / 2  # Split in the middle of the gap
-            split_page = pdf_page.crop((x0, y0, x1, split_point))
-            split_pages.append(split_page)
+        # Only the chars are needed, so crop them instead of the whole page
+        chars = crop_to_bbox(page.chars, (x0, top, x1, bottom))
 
-            # The split point becomes the top of the next page
-            y0 = split_point
+        # Split the cropped page at large gaps and extract the text of each part
+        for j, split_page_raw_text in enumerate(
+            split_chars_on_gaps(chars, gap_threshold)
+        ):
+            # Use a tuple (i, j) as the key to keep track of the original page number
+            # and the split page number
+            yield (i, j), remove_hyphens(split_page_raw_text)
 
-    # Add the last page
-    split_pages.append(pdf_page.crop((x0, y0, x1, y1)))
 
-    return split_pages
+def split_pdf_and_extract_text_portrait(pdf, gap_threshold, keep_report=False):
+    return split_main_and_secondary(
+        iter_text_blocks_portrait(pdf, gap_threshold), keep_report
+    )
 
 
-def split_pdf_and_extract_text_portrait(response, gap_threshold):
-    # Open the PDF file with pdfplumber
-    with pdfplumber.open(io.BytesIO(response.content)) as pdf:
-        # Initialize an empty dictionary to hold the PDF text
-        full_pdf_text = {}
-
-        # For each page in the PDF
-        for i, page in enumerate(pdf.pages):
-            # Calculate the crop dimensions based on the page number
-            if (i + 1) % 2 == 0:  # even pages
-                x0 = page.bbox[0] + 85
-                x1 = page.bbox[2]
-            else:  # odd pages
-                x0 = page.bbox[0]
-                x1 = page.bbox[2] - 85
-
-            # Crop the header and footer
-            top = page.bbox[1] + (21.9 * 2.83465)
-            bottom = page.bbox[3] - (22.6 * 2.83465)
-
-            cropped_page = page.crop((x0, top, x1, bottom))
-
-            # Split the cropped page at large gaps
-            split_pages = split_page_on_gaps(cropped_page, gap_threshold)
-
-            # Extract the text from each split page
-            for j, split_page in enumerate(split_pages):
-                # Use a tuple (i, j) as the key to keep track of the original page number
-                # and the split page number
-                split_page_raw_text = split_page.extract_text()
-                full_pdf_text[(i, j)] = remove_hyphens(split_page_raw_text)
-
-    # Define the flags
-    found_roman_ii = False
+def find_columns(pdf, sample_pages=10):
+    # Histogram of the x-positions covered by chars on the first pages,
+    # runs of empty bins between text are the gutters between columns
+    width = pdf.pages[0].width
+    bins = [0] * (int(width / column_bin_width) + 1)
+    for page in pdf.pages[:sample_pages]:
+        top, bottom = body_bounds(page)
+        for char in page.chars:
+            if char["top"] < top or char["bottom"] > bottom:
+                continue
+            first_bin = max(int(char["x0"] / column_bin_width), 0)
+            last_bin = min(int(char["x1"] / column_bin_width), len(bins) - 1)
+            for b in range(first_bin, last_bin + 1):
+                bins[b] += 1
+
+    covered = [b for b, count in enumerate(bins) if count]
+    if not covered:
+        return []
+
+    gutters = []
+    start = None
+    for b in range(covered[0], covered[-1] + 1):
+        if bins[b] == 0 and start is None:
+            start = b
+        elif bins[b] and start is not None:
+            gutters.append((b - start, (start + b) / 2 * column_bin_width))
+            start = None
+
+    # Keep the widest gutters, a Synopse has at most max_columns columns
+    gutters = [
+        gutter for gutter in gutters if gutter[0] * column_bin_width >= min_gutter
+    ]
+    gutters = sorted(gutters, reverse=True)[: max_columns - 1]
+    return sorted(x for _, x in gutters)
+
+
+def iter_text_blocks_landscape(pdf, gap_threshold):
+    # Column boundaries are found once and reused for every page
+    boundaries = find_columns(pdf)
+
+    for i, page in enumerate(pdf.pages):
+        top, bottom = body_bounds(page)
+        chars = crop_to_bbox(page.chars, (page.bbox[0], top, page.bbox[2], bottom))
+
+        # The last column holds the proposed wording of the law
+        proposal = [
+            char
+            for char in chars
+            if (char["x0"] + char["x1"]) / 2 > (boundaries[-1] if boundaries else 0)
+        ]
+
+        for j, split_page_raw_text in enumerate(
+            split_chars_on_gaps(proposal, gap_threshold)
+        ):
+            yield (i, j), remove_hyphens(split_page_raw_text)
+
+
+def split_pdf_and_extract_text_landscape(pdf, gap_threshold, keep_report=False):
+    return split_main_and_secondary(
+        iter_text_blocks_landscape(pdf, gap_threshold), keep_report
+    )
+
+
+def classify_text_blocks(text_blocks, keep_report=False):
+    """Yield (key, section, text) with section "main", "secondary" or "report".
+
+    Without keep_report the blocks stop at the report, so the pages after
+    it are never parsed.
+    """
+    section = "main"
+    is_totalrevision = False
+
+    for key, text in text_blocks:
+        # A block that only contains the word "Bericht" starts the report
+        is_report = "Bericht" == text.strip()
+
+        # Everything from the first "II." on amends other laws
+        if section == "main" and roman_ii_pattern.search(text):
+            section = "secondary"
+        elif is_report and (section == "secondary" or is_totalrevision):
+            section = "report"
+
+        if section == "report" and not keep_report:
+            return
+        if section == "main" and totalrevision_marker in text:
+            is_totalrevision = True
+
+        yield key, section, text
+
+
+def split_main_and_secondary(text_blocks, keep_report=False):
+    full_pdf_text = {}
     main_pdf_text = {}
     secondary_pdf_text = {}
 
-    # Extract the text from each split page
-    for (i, j), text in full_pdf_text.items():
-        # If we haven't encountered the "II." yet, it's part of the main_pdf_text
-        if re.search(r"(?<![IVXLCDM])II\.(?![IVXLCDM])", text) and not found_roman_ii:
-            found_roman_ii = True
-
-        if found_roman_ii:
-            if "Bericht" == text.strip():
-                break  # exit if the current page only contains the word "Bericht"
-            secondary_pdf_text[(i, j)] = text
-        else:
-            main_pdf_text[(i, j)] = text
+    for key, section, text in classify_text_blocks(text_blocks, keep_report):
+        full_pdf_text[key] = text
+        if section == "main":
+            main_pdf_text[key] = text
+        elif section == "secondary":
+            secondary_pdf_text[key] = text
 
     return full_pdf_text, main_pdf_text, secondary_pdf_text
 
 
-def pdf_reader():
-    # Load JSON data
-    with open("krzh_dispatch_data.json", "r", encoding="utf-8") as f:
-        krversand_data = json.load(f)
-
-    # Go through all records
-    for record in krversand_data:
-        # Go through all vorlagen in record
-        for vorlage in record["Vorlagen"]:
-            # Get PDF_URL
-            pdf_url = vorlage["PDF_URL"]
-
-            # Check if fields already exist, skip the current loop iteration if they do
-            if all(
-                key in vorlage
-                for key in [
-                    "original_pdf_data",
-                    "primary_pdf_data",
-                    "secondary_pdf_data",
-                    "primary_norms",
-                    "secondary_norms",
-                ]
-            ):
-                continue
-
+def split_totalrevision(full_pdf_text):
+    # The enacted law follows the Totalrevision marker, the changes to other
+    # laws follow in the Anhang, everything stops at the report
+    law_pdf_text = {}
+    annex_pdf_text = {}
+    section = None
+
+    for key, text in full_pdf_text.items():
+        if "Bericht" == text.strip():
+            break
+        if section is None and totalrevision_marker in text:
+            section = law_pdf_text
+        elif section is law_pdf_text and annex_pattern.match(text):
+            section = annex_pdf_text
+        if section is not None:
+            section[key] = text
+
+    return law_pdf_text, annex_pdf_text
+
+
+def download_pdf(pdf_url, cache):
+    # Serve the PDF from the local cache if we have seen it before
+    edoc_id, version = cache_key(pdf_url)
+    pdf_path = cache.get(edoc_id, version)
+    if pdf_path is not None:
+        return pdf_path
+
+    return cache.put(edoc_id, version, client.get(pdf_url))
+
+
+def process_pdf(pdf_path, keep_report=False):
+    # Runs in a worker process, returns the fields to add to the vorlage
+    # and the statistics of the extraction
+    start = time.perf_counter()
+    with open_mapped(pdf_path) as pdf_file:
+        with pdfplumber.open(pdf_file) as pdf:
+            fields = extract_fields(pdf, keep_report)
+            pages = len(pdf.pages)
+        size = len(pdf_file)
+    return fields, {
+        "pages": pages,
+        "size": size,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def extract_pdf_fields(pdf_file, keep_report=False):
+    # Open the PDF file once for all steps
+    with pdfplumber.open(pdf_file) as pdf:
+        return extract_fields(pdf, keep_report)
+
+
+def extract_fields(pdf, keep_report=False):
+    fields = {}
+
+    # Check orientation of the first page
+    is_landscape = pdf.pages[0].width > pdf.pages[0].height
+
+    # Landscape PDFs are Synopse tables, only their last column is read
+    if is_landscape:
+        split_pdf = split_pdf_and_extract_text_landscape
+    else:
+        split_pdf = split_pdf_and_extract_text_portrait
+
+    (
+        original_pdf_data,
+        primary_pdf_data,
+        secondary_pdf_data,
+    ) = split_pdf(pdf, 7.75, keep_report)
+    # A Totalrevision lists the paragraphs of the enacted law and the changes
+    # to other laws in its Anhang
+    if check_totalrevision(primary_pdf_data):
+        fields["Totalrevision"] = True
+        primary_pdf_data, secondary_pdf_data = split_totalrevision(original_pdf_data)
+        primary_norms = extract_primary_norms(primary_pdf_data)
+        secondary_norms = extract_annex_norms(list(secondary_pdf_data.values()))
+    else:
+        primary_norms = extract_primary_norms(primary_pdf_data)
+        secondary_norms = extract_secondary_norms(list(secondary_pdf_data.values()))
+
+    # Note if no norms were found
+    if not primary_norms:
+        primary_norms = ["Keine Normen gefunden."]
+    if not secondary_norms:
+        secondary_norms = ["Keine Normen gefunden."]
+
+    # Get law as list
+    original_pdf_data = [text for text in original_pdf_data.values()]
+    primary_pdf_data = [text for text in primary_pdf_data.values()]
+    secondary_pdf_data = [text for text in secondary_pdf_data.values()]
+
+    fields["original_pdf_data"] = original_pdf_data
+    fields["primary_pdf_data"] = primary_pdf_data
+    fields["secondary_pdf_data"] = secondary_pdf_data
+    fields["primary_norms"] = primary_norms
+    fields["secondary_norms"] = secondary_norms
+
+    return fields
+
+
+def pdf_reader(
+    download_workers=4,
+    extract_workers=None,
+    max_in_flight=16,
+    reextract=False,
+    keep_report=False,
+):
+    # Collect all vorlagen that still need to be processed, in file order
+    # Re-extraction reads the cached PDFs again with the current heuristics
+    with DispatchStore() as store:
+        pending = store.pending_vorlagen(reextract=reextract)
+
+    if not pending:
+        return
+
+    cache = PdfCache()
+    # Bound the number of PDFs held in memory between download and extraction
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    # A worker process dying, e.g. killed for running out of memory, breaks
+    # the whole pool. It is replaced by a new pool for the PDFs still to come
+    extract_workers = extract_workers or os.cpu_count()
+    extractors = [ProcessPoolExecutor(extract_workers)]
+    extractors_lock = threading.Lock()
+
+    def replace_extractor(broken):
+        with extractors_lock:
+            if extractors[-1] is broken:
+                logging.warning("A PDF extraction process died, restarting the pool")
+                metrics.count("pdf_pool_restarts")
+                broken.shutdown(wait=False, cancel_futures=True)
+                extractors.append(ProcessPoolExecutor(extract_workers))
+            return extractors[-1]
+
+    # Pools start their processes on submit from several threads, a process
+    # forked by one pool must not inherit the pipes of another pool's new
+    # process, or the death of that process goes unnoticed
+    submit_lock = threading.Lock()
+
+    def submit(extractor, pdf_path):
+        with submit_lock:
+            return extractor.submit(process_pdf, pdf_path, keep_report)
+
+    def extract_alone(pdf_url):
+        # The extractions of a broken pool all fail, no matter which PDF
+        # killed its process. Each is repeated in a process of its own, so
+        # only the PDF killing that process again counts as failed
+        pdf_path = download_pdf(pdf_url, cache)
+        with ProcessPoolExecutor(1) as isolated:
+            return submit(isolated, pdf_path).result()
+
+    with ThreadPoolExecutor(download_workers) as downloader, DispatchStore() as store:
+
+        def download_and_extract(pdf_url):
+            try:
+                pdf_path = download_pdf(pdf_url, cache)
+                extractor = extractors[-1]
+                try:
+                    extraction = submit(extractor, pdf_path)
+                except BrokenProcessPool:
+                    extraction = submit(replace_extractor(extractor), pdf_path)
+            except BaseException:
+                in_flight.release()
+                raise
+            extraction.add_done_callback(lambda _: in_flight.release())
+            return extraction
+
+        def store_result(vorlage_id, pdf_url, download):
             try:
-                # Download PDF content
-                response = requests.get(pdf_url)
-                response.raise_for_status()
-                sleep(1)  # Be polite to the server
-
-                # Open the PDF file with pdfplumber
-                with pdfplumber.open(io.BytesIO(response.content)) as pdf:
-                    # Check orientation of the first page
-                    is_landscape = pdf.pages[0].width > pdf.pages[0].height
-
-                    # Manual extraction if law is in new format
-                    if is_landscape:
-                        primary_norms = ["Neues Format: Manuelle Prüfung erforderlich."]
-                        secondary_norms = ["Synopse: Manuelle Prüfung erforderlich."]
-                    else:
-                        (
-                            original_pdf_data,
-                            primary_pdf_data,
-                            secondary_pdf_data,
-                        ) = split_pdf_and_extract_text_portrait(response, 7.75)
-                        primary_norms = extract_primary_norms(primary_pdf_data)
-                        # Manual extraction of secondary norms if law is a totalrevision is true
-                        if check_totalrevision(primary_pdf_data):
-                            vorlage["Totalrevision"] = True
-                            secondary_norms = [
-                                "Totalrevision: Manuelle Prüfung gemäss Anhang erforderlich."
-                            ]
-                        else:
-                            secondary_norms = extract_secondary_norms(
-                                list(secondary_pdf_data.values())
-                            )
-
-                        # Note if no norms were found
-                        if not primary_norms:
-                            primary_norms = ["Keine Normen gefunden."]
-                        if not secondary_norms:
-                            secondary_norms = ["Keine Normen gefunden."]
-
-                        # Get law as list
-                        original_pdf_data = [
-                            text for text in original_pdf_data.values()
-                        ]
-                        primary_pdf_data = [text for text in primary_pdf_data.values()]
-                        secondary_pdf_data = [
-                            text for text in secondary_pdf_data.values()
-                        ]
-
-                    # Add norms to vorlage in krversand_data
-                    vorlage["original_pdf_data"] = original_pdf_data
-                    vorlage["primary_pdf_data"] = primary_pdf_data
-                    vorlage["secondary_pdf_data"] = secondary_pdf_data
-                    vorlage["primary_norms"] = primary_norms
-                    vorlage["secondary_norms"] = secondary_norms
-
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Error downloading PDF from {pdf_url}: {e}")
+                try:
+                    fields, stats = download.result().result()
+                except BrokenProcessPool:
+                    fields, stats = extract_alone(pdf_url)
             except Exception as e:
-                logging.error(f"Error processing PDF from {pdf_url}: {e}")
-
-    # Write data back to JSON
-    with open("krzh_dispatch_data.json", "w", encoding="utf-8") as f:
-        json.dump(krversand_data, f, indent=4, ensure_ascii=False)
+                if isinstance(e, requests.exceptions.RequestException):
+                    logging.error(f"Error downloading PDF from {pdf_url}: {e}")
+                else:
+                    logging.error(f"Error processing PDF from {pdf_url}: {e}")
+                attempts = store.record_failure(vorlage_id, e)
+                metrics.count("pdf_failures")
+                if attempts >= max_attempts:
+                    logging.error(f"Giving up on {pdf_url} after {attempts} attempts")
+            else:
+                metrics.record_pdf(pdf_url, **stats)
+                store.update_vorlage(vorlage_id, fields)
+
+        def is_finished(download):
+            return download.done() and (
+                download.exception() is not None or download.result().done()
+            )
+
+        # Each result is committed as soon as it is ready, so an interrupted
+        # run keeps its work and the next run only picks up the rest
+        running = {}
+        try:
+            for vorlage_id, vorlage in pending:
+                in_flight.acquire()
+                pdf_url = vorlage.pdf_url
+                # Run in the current context so requests count for this stage
+                running[vorlage_id] = (
+                    pdf_url,
+                    downloader.submit(
+                        contextvars.copy_context().run, download_and_extract, pdf_url
+                    ),
+                )
+                for finished_id in [
+                    key
+                    for key, (_, download) in running.items()
+                    if is_finished(download)
+                ]:
+                    store_result(finished_id, *running.pop(finished_id))
+
+            for vorlage_id, (pdf_url, download) in list(running.items()):
+                store_result(vorlage_id, pdf_url, download)
+        except BaseException:
+            # Do not start any more work on Ctrl-C or a crash
+            downloader.shutdown(cancel_futures=True)
+            extractors[-1].shutdown(cancel_futures=True)
+            raise
+        finally:
+            extractors[-1].shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from datetime import date
+
+# Optional, parses the JSON files several times faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def parse_date(text):
+    """Parse "DD.MM.YYYY", "YYYY-MM-DD" or "YYYYMMDD", None for anything else."""
+    text = (text or "").strip()
+    try:
+        if len(text) == 10 and text[2] == "." and text[5] == ".":
+            return date(int(text[6:]), int(text[3:5]), int(text[:2]))
+        if len(text) == 10 and text[4] == "-" and text[7] == "-":
+            return date(int(text[:4]), int(text[5:7]), int(text[8:]))
+        if len(text) == 8 and text.isdigit():
+            return date(int(text[:4]), int(text[4:6]), int(text[6:]))
+    except ValueError:
+        pass
+    return None
+
+
+def format_date(value, date_format="%d.%m.%Y"):
+    return value.strftime(date_format) if value is not None else None
+
+
+@dataclass(slots=True)
+class Vorlage:
+    """A vorlage of a KR-Versand and the norms extracted from its PDF."""
+
+    title: str | None
+    affair_type: str | None
+    pdf_url: str | None
+    vorlagen_nr: str | None
+    rr_antrag: date | None = None
+    latest_step: str | None = None
+    latest_step_date: date | None = None
+    # Set once the PDF has been extracted
+    text_key: str | None = None
+    totalrevision: bool = False
+    primary_norms: list | None = None
+    secondary_norms: list | dict | None = None
+
+    @classmethod
+    def from_legacy(cls, vorlage):
+        return cls(
+            title=vorlage.get("Geschäftstitel"),
+            affair_type=vorlage.get("Geschäftsart"),
+            pdf_url=vorlage.get("PDF_URL"),
+            vorlagen_nr=vorlage.get("VorlagenNr"),
+            rr_antrag=parse_date(vorlage.get("RR_Antrag")),
+            latest_step=vorlage.get("latest_step"),
+            latest_step_date=parse_date(vorlage.get("latest_step_date")),
+            text_key=vorlage.get("text_key"),
+            totalrevision=bool(vorlage.get("Totalrevision")),
+            primary_norms=vorlage.get("primary_norms"),
+            secondary_norms=vorlage.get("secondary_norms"),
+        )
+
+    def to_legacy(self):
+        """Return the vorlage in the format of krzh_dispatch_data.json."""
+        vorlage = {
+            "Geschäftstitel": self.title,
+            "Geschäftsart": self.affair_type,
+            "PDF_URL": self.pdf_url,
+            "VorlagenNr": self.vorlagen_nr,
+            "RR_Antrag": format_date(self.rr_antrag),
+            "latest_step": self.latest_step,
+            "latest_step_date": format_date(self.latest_step_date),
+        }
+        if self.text_key is None:
+            return vorlage
+
+        if self.totalrevision:
+            vorlage["Totalrevision"] = True
+        vorlage["text_key"] = self.text_key
+        vorlage["primary_norms"] = self.primary_norms
+        vorlage["secondary_norms"] = self.secondary_norms
+        return vorlage
+
+
+@dataclass(slots=True)
+class Dispatch:
+    """A KR-Versand with its vorlagen."""
+
+    date: date
+    vorlagen: list = field(default_factory=list)
+    # KRVersand OBJ_GUID and hash of the parsed dispatch, see krzh_dispatch()
+    guid: str | None = None
+    content_hash: str | None = None
+
+    @classmethod
+    def from_legacy(cls, record):
+        return cls(
+            date=parse_date(record["Datum KR-Versand"]),
+            vorlagen=[Vorlage.from_legacy(vorlage) for vorlage in record["Vorlagen"]],
+            guid=record.get("KRVersand_ID"),
+            content_hash=record.get("content_hash"),
+        )
+
+    def to_legacy(self):
+        """Return the dispatch in the format of krzh_dispatch_data.json."""
+        record = {"Datum KR-Versand": format_date(self.date)}
+        if self.guid is not None:
+            record["KRVersand_ID"] = self.guid
+            record["content_hash"] = self.content_hash
+        record["Vorlagen"] = [vorlage.to_legacy() for vorlage in self.vorlagen]
+        return record
+
+
+@dataclass(slots=True)
+class Initiative:
+    """A decision on an initiative, identified by KRNr, step and date."""
+
+    vorlage_type: str | None
+    vorlage_title: str | None
+    krnr: str | None
+    decision: str | None
+    decision_abstract: str | None
+    decision_date: date | None
+    pdf_url: str | None
+
+    @property
+    def key(self):
+        return self.krnr, self.decision, self.decision_date
+
+    @classmethod
+    def from_legacy(cls, entry):
+        return cls(
+            vorlage_type=entry.get("vorlage_type"),
+            vorlage_title=entry.get("vorlage_title"),
+            krnr=entry.get("krnr"),
+            decision=entry.get("decision"),
+            decision_abstract=entry.get("decision_abstract"),
+            decision_date=parse_date(entry.get("decision_date")),
+            pdf_url=entry.get("pdf_url"),
+        )
+
+    def to_legacy(self):
+        """Return the entry in the format of krzh_initiatives_data.json."""
+        return {
+            "vorlage_type": self.vorlage_type,
+            "vorlage_title": self.vorlage_title,
+            "krnr": self.krnr,
+            "decision": self.decision,
+            "decision_abstract": self.decision_abstract,
+            "decision_date": format_date(self.decision_date, "%Y%m%d"),
+            "pdf_url": self.pdf_url,
+        }
+
+
+def read_json(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def write_json(path, data):
+    # Replace the file in one step, an interrupted write keeps the old one.
+    # The files are written by the json module in any case, so their
+    # formatting does not depend on the installed packages
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,155 @@
+// Full-text search over the index written by search_index.py. Queries are
+// split into terms like the indexed text, only the shards of these terms
+// are fetched.
+(function () {
+    const maxResults = 50;
+
+    const crcTable = Array.from({ length: 256 }, (_, n) => {
+        let c = n;
+        for (let k = 0; k < 8; k++) {
+            c = c & 1 ? 0xedb88320 ^ (c >>> 1) : c >>> 1;
+        }
+        return c >>> 0;
+    });
+
+    function crc32(text) {
+        let c = 0xffffffff;
+        for (const byte of new TextEncoder().encode(text)) {
+            c = crcTable[(c ^ byte) & 0xff] ^ (c >>> 8);
+        }
+        return (c ^ 0xffffffff) >>> 0;
+    }
+
+    function stem(meta, word) {
+        word = word.replace(/[äöüß]/g, (letter) => meta.umlauts[letter]);
+        for (const suffix of meta.suffixes) {
+            if (word.endsWith(suffix) && word.length - suffix.length >= meta.min_stem_length) {
+                return word.slice(0, -suffix.length);
+            }
+        }
+        return word;
+    }
+
+    function tokenize(meta, text) {
+        const terms = [];
+        text = text.replace(
+            new RegExp(meta.norm_pattern, "g"),
+            (_, paragraph, suffix, last, lastSuffix) => {
+                terms.push("§" + paragraph + (suffix || ""));
+                if (last) {
+                    terms.push("§" + last + (lastSuffix || ""));
+                }
+                return " ";
+            }
+        );
+        for (const word of text.toLowerCase().match(/[\p{L}\p{N}]+/gu) || []) {
+            if (word.length > 1 && !meta.stopwords.has(word)) {
+                terms.push(stem(meta, word));
+            }
+        }
+        return [...new Set(terms)];
+    }
+
+    function setup(box) {
+        const base = box.dataset.index;
+        const input = box.querySelector("input");
+        const results = box.querySelector(".search-results");
+        const cache = {};
+        let meta = null;
+        let timer = null;
+        let latest = 0;
+
+        function load(name) {
+            if (!(name in cache)) {
+                cache[name] = fetch(`${base}/${name}`).then((response) => {
+                    if (!response.ok) {
+                        throw new Error(`${response.status} ${name}`);
+                    }
+                    return response.json();
+                });
+            }
+            return cache[name];
+        }
+
+        async function search(query) {
+            if (meta === null) {
+                meta = await load("meta.json");
+                meta.stopwords = new Set(meta.stopwords);
+            }
+            const terms = tokenize(meta, query);
+            if (!terms.length) {
+                return [];
+            }
+            const [docs, ...shards] = await Promise.all(
+                [load("docs.json")].concat(
+                    terms.map((term) => load(`shard-${crc32(term) % meta.shards}.json`))
+                )
+            );
+
+            // Documents holding all terms, ranked by tf-idf
+            let scores = null;
+            terms.forEach((term, i) => {
+                const postings = shards[i][term] || [];
+                const idf = Math.log(1 + meta.documents / Math.max(1, postings.length / 2));
+                const next = new Map();
+                let number = 0;
+                for (let j = 0; j < postings.length; j += 2) {
+                    number += postings[j];
+                    if (scores === null || scores.has(number)) {
+                        const count = postings[j + 1];
+                        const score = (count / (count + 1.2)) * idf;
+                        next.set(number, (scores === null ? 0 : scores.get(number)) + score);
+                    }
+                }
+                scores = next;
+            });
+
+            return [...scores]
+                .sort((a, b) => b[1] - a[1] || b[0] - a[0])
+                .slice(0, maxResults)
+                .map(([number]) => docs[number]);
+        }
+
+        function show(hits, query) {
+            results.replaceChildren();
+            if (!hits.length && query.trim()) {
+                const item = document.createElement("li");
+                item.textContent = "Keine Treffer";
+                results.append(item);
+            }
+            for (const hit of hits) {
+                const item = document.createElement("li");
+                const link = document.createElement("a");
+                link.href = hit.page || hit.pdf;
+                link.textContent = `${hit.date} – ${hit.nr}: ${hit.title}`;
+                item.append(link);
+                if (hit.page && hit.pdf) {
+                    const pdf = document.createElement("a");
+                    pdf.href = hit.pdf;
+                    pdf.textContent = "PDF";
+                    item.append(" (", pdf, ")");
+                }
+                results.append(item);
+            }
+        }
+
+        input.addEventListener("input", () => {
+            clearTimeout(timer);
+            timer = setTimeout(async () => {
+                const query = input.value;
+                const current = ++latest;
+                try {
+                    const hits = await search(query);
+                    if (current === latest) {
+                        show(hits, query);
+                    }
+                } catch (error) {
+                    results.textContent = "Suche nicht verfügbar";
+                    console.error(error);
+                }
+            }, 200);
+        });
+    }
+
+    document.querySelectorAll(".search[data-index]").forEach(setup);
+})();
@@ -0,0 +1,116 @@
+import re
+import zlib
+from collections import Counter
+
+from norms import paragraph_pattern
+
+# Directory holding the search index of each page
+search_dir = "search"
+
+# Shards are added in powers of two once they hold more terms than this
+terms_per_shard = 2000
+
+# A norm like "§ 12a" or "§§ 12 bis" is kept as a single term "§12a", a
+# range like "§§ 14 bis 16" or "§§ 14-16" gives a term for each end
+norm_pattern = re.compile(
+    rf"§§?\s*{paragraph_pattern.pattern}"
+    rf"(?:\s*(?:bis|-|–)\s*{paragraph_pattern.pattern})?"
+)
+
+word_pattern = re.compile(r"[^\W_]+")
+
+# Words broken over two lines of the PDF text
+hyphenation_pattern = re.compile(r"(?<=\w)-\n(?=[a-zäöü])")
+
+stopwords = """
+aber als am an auch auf aus bei bis das dass de dem den der des die diese
+dieser dieses durch ein eine einem einen einer eines er es für gemäss hat
+im in ist kann mit nach nicht noch oder sich sie sind so soll über um und
+vom von vor wenn werden wird wie zu zum zur
+""".split()
+stopword_set = set(stopwords)
+
+# Light German stemming, folded umlauts and the longest of these suffixes
+# is removed as long as min_stem_length characters remain
+umlauts = {"ä": "a", "ö": "o", "ü": "u", "ß": "ss"}
+umlaut_table = str.maketrans(umlauts)
+suffixes = ["ern", "em", "en", "er", "es", "e", "n", "s"]
+min_stem_length = 4
+
+
+def stem(word):
+    word = word.translate(umlaut_table)
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= min_stem_length:
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenize(text):
+    """Split text into search terms, norms first and then stemmed words.
+
+    search.js does the same for the queries, with the settings of meta.json.
+    """
+    terms = []
+
+    def take_norm(match):
+        terms.append(f"§{match.group(1)}{match.group(2) or ''}")
+        if match.group(3):
+            terms.append(f"§{match.group(3)}{match.group(4) or ''}")
+        return " "
+
+    text = norm_pattern.sub(take_norm, hyphenation_pattern.sub("", text))
+    for word in word_pattern.findall(text.lower()):
+        if len(word) > 1 and word not in stopword_set:
+            terms.append(stem(word))
+    return terms
+
+
+def term_shard(term, shard_count):
+    # Stable across runs and cheap to compute in the browser
+    return zlib.crc32(term.encode("utf-8")) % shard_count
+
+
+def build_index(documents):
+    """Return the files of an inverted index over documents.
+
+    documents yields (entry, text) pairs, entry is what search.js shows for
+    a hit. Document numbers follow their order, so with the oldest first
+    new documents leave the existing postings and most shards unchanged.
+    Postings of a term are [gap, count, gap, count, ...] with the gaps
+    between the document numbers. Returns {file name: JSON data}.
+    """
+    entries = []
+    postings = {}
+    for number, (entry, text) in enumerate(documents):
+        entries.append(entry)
+        for term, count in Counter(tokenize(text)).items():
+            postings.setdefault(term, []).append((number, count))
+
+    shard_count = 1
+    while shard_count * terms_per_shard < len(postings):
+        shard_count *= 2
+    shards = [{} for _ in range(shard_count)]
+    for term in sorted(postings):
+        encoded = []
+        previous = 0
+        for number, count in postings[term]:
+            encoded += [number - previous, count]
+            previous = number
+        shards[term_shard(term, shard_count)][term] = encoded
+
+    files = {
+        "meta.json": {
+            "documents": len(entries),
+            "shards": shard_count,
+            "norm_pattern": norm_pattern.pattern,
+            "stopwords": stopwords,
+            "umlauts": umlauts,
+            "suffixes": suffixes,
+            "min_stem_length": min_stem_length,
+        },
+        "docs.json": entries,
+    }
+    for number, shard in enumerate(shards):
+        files[f"shard-{number}.json"] = shard
+    return files
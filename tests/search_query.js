@@ -0,0 +1,73 @@
+// Runs search.js in node against an index directory and prints the hits of
+// each query as JSON: node search_query.js <index directory> <query>...
+const fs = require("fs");
+const path = require("path");
+
+const [directory, ...queries] = process.argv.slice(2);
+
+function element() {
+    return {
+        children: [],
+        textContent: "",
+        append(...items) {
+            this.children.push(...items);
+        },
+    };
+}
+
+let rendered = null;
+const input = {
+    value: "",
+    addEventListener(type, listener) {
+        this.listener = listener;
+    },
+};
+const results = {
+    ...element(),
+    // search.js only sets the text of the list when a search failed
+    set textContent(text) {
+        console.error(text);
+        process.exit(1);
+    },
+    replaceChildren() {
+        this.children = [];
+        // show() appends the hits right after clearing the list
+        setImmediate(() => rendered(this.children));
+    },
+};
+const box = {
+    dataset: { index: directory },
+    querySelector: (selector) => (selector === "input" ? input : results),
+};
+
+globalThis.document = {
+    querySelectorAll: () => [box],
+    createElement: element,
+};
+globalThis.fetch = async (url) => {
+    const file = path.join(directory, path.basename(url));
+    if (!fs.existsSync(file)) {
+        return { ok: false, status: 404 };
+    }
+    const data = fs.readFileSync(file, "utf8");
+    return { ok: true, status: 200, json: async () => JSON.parse(data) };
+};
+
+require(path.join(__dirname, "..", "search.js"));
+
+(async () => {
+    const hits = {};
+    for (const query of queries) {
+        const items = await new Promise((resolve) => {
+            rendered = resolve;
+            input.value = query;
+            input.listener();
+        });
+        // Each hit is a list item holding the link to the page or PDF
+        hits[query] = items
+            .map((item) => item.children[0])
+            .filter((link) => link && link.href)
+            .map((link) => link.href);
+    }
+    console.log(JSON.stringify(hits));
+})();
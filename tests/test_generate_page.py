@@ -0,0 +1,70 @@
+from datetime import date
+
+import pytest
+
+import generate_page as generate_page_module
+from dispatch_store import DispatchStore, database_file
+from generate_page import generate_page
+from records import Dispatch, Vorlage
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # generate_page() reads and writes its files in the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_legacy_json_name_renders_the_dispatch_store(workdir):
+    with DispatchStore(database_file) as store:
+        store.add_dispatch(
+            Dispatch(
+                date=date.today(),
+                guid="g1",
+                vorlagen=[
+                    Vorlage(
+                        title="Änderung des Steuergesetzes",
+                        affair_type="Vorlage",
+                        pdf_url="a.pdf",
+                        vorlagen_nr="5800",
+                    )
+                ],
+            )
+        )
+
+    assert generate_page("krzh_dispatch_data.json", "Ratsversand", "krzh_dispatch")
+    assert "Änderung des Steuergesetzes" in (workdir / "krzh_dispatch.html").read_text(
+        encoding="utf-8"
+    )
+
+
+def test_unknown_file_raises(workdir):
+    with pytest.raises(ValueError):
+        generate_page("unknown.json", "Unbekannt", "unknown")
+    assert not (workdir / "unknown.html").exists()
+
+
+def test_renderer_change_invalidates_fragments(workdir, monkeypatch):
+    with DispatchStore(database_file) as store:
+        store.add_dispatch(
+            Dispatch(
+                date=date.today(),
+                guid="g1",
+                vorlagen=[Vorlage("Titel", "Vorlage", "a.pdf", "5800")],
+            )
+        )
+    assert generate_page(database_file, "Ratsversand", "krzh_dispatch", archive=True)
+
+    original = generate_page_module.render_dispatch
+
+    def render_dispatch(item):
+        return '<div class="new-markup">' + original(item) + "</div>"
+
+    monkeypatch.setattr(generate_page_module, "render_dispatch", render_dispatch)
+    assert generate_page(database_file, "Ratsversand", "krzh_dispatch", archive=True)
+
+    page = (workdir / "krzh_dispatch.html").read_text(encoding="utf-8")
+    archive = list((workdir / "archive" / "krzh_dispatch").glob("20*.html"))
+    assert "new-markup" in page
+    assert archive
+    assert all("new-markup" in path.read_text(encoding="utf-8") for path in archive)
@@ -0,0 +1,42 @@
+import pytest
+
+from law_index import law_key, paragraphs_of, vorlage_laws
+from records import Vorlage
+
+
+@pytest.mark.parametrize(
+    "norm, paragraphs",
+    [
+        ("§ 12", ["§ 12"]),
+        ("§ 12a Abs. 2 lit. b", ["§ 12a"]),
+        ("§ 12 a", ["§ 12a"]),
+        ("§ 14bis", ["§ 14bis"]),
+        ("§ 3 e contrario", ["§ 3"]),
+        ("§§ 14 bis 16", ["§ 14", "§ 15", "§ 16"]),
+        ("§§ 14-16", ["§ 14", "§ 15", "§ 16"]),
+        ("§§ 14 a bis 16", ["§ 14a", "§ 16"]),
+        ("Keine Normen gefunden.", []),
+    ],
+)
+def test_paragraphs_of(norm, paragraphs):
+    assert paragraphs_of(norm) == paragraphs
+
+
+def test_range_reference_lists_no_made_up_paragraph():
+    vorlage = Vorlage(
+        title="Änderung des Steuergesetzes",
+        affair_type="Vorlage",
+        pdf_url="a.pdf",
+        vorlagen_nr="5800",
+        text_key="a",
+        primary_norms=["§ 12", "§§ 14 bis 16"],
+        secondary_norms={"Gemeindegesetz vom 20. April 2015": ["§ 40 bis 41"]},
+    )
+    laws = vorlage_laws(vorlage)
+    assert laws[law_key("Steuergesetz")]["paragraphs"] == [
+        "§ 12",
+        "§ 14",
+        "§ 15",
+        "§ 16",
+    ]
+    assert laws[law_key("Gemeindegesetz")]["paragraphs"] == ["§ 40", "§ 41"]
@@ -0,0 +1,51 @@
+import pytest
+
+from norms import extract_primary_norms, parse_norm
+
+
+@pytest.mark.parametrize(
+    "text, paragraph, suffix",
+    [
+        ("§ 12", 12, ""),
+        ("§ 12a", 12, "a"),
+        ("§ 12 a", 12, "a"),
+        ("§ 12bis", 12, "bis"),
+        ("§ 12 bis", 12, "bis"),
+        ("§ 12 ter Abs. 2", 12, "ter"),
+        ("§ 20 a Abs. 2 lit. b", 20, "a"),
+        ("§ 14 a und 15", 14, "a"),
+    ],
+)
+def test_parse_norm_suffix(text, paragraph, suffix):
+    norm = parse_norm(text)
+    assert (norm.paragraph, norm.suffix) == (paragraph, suffix)
+
+
+@pytest.mark.parametrize(
+    "text", ["§§ 14 bis 16", "§§ 14 bis16", "§§ 14-16", "§§ 14 bis 16 Abs. 2"]
+)
+def test_parse_norm_range_starts_at_first_paragraph(text):
+    norm = parse_norm(text)
+    assert (norm.paragraph, norm.suffix) == (14, "")
+
+
+def test_parse_norm_ignores_word_after_space():
+    norm = parse_norm("§ 3 e contrario")
+    assert (norm.paragraph, norm.suffix) == (3, "")
+
+
+def test_primary_norms_natural_order():
+    texts = {
+        (0, 0): "§ 13. Text",
+        (0, 1): "§ 12 a. Text",
+        (0, 2): "§ 12bis. Text",
+        (1, 0): "§ 12. Text",
+        (1, 1): "§§ 14 bis 16. Text",
+    }
+    assert extract_primary_norms(texts) == [
+        "§ 12",
+        "§ 12bis",
+        "§ 12 a",
+        "§ 13",
+        "§§ 14 bis 16",
+    ]
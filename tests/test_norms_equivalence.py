@@ -0,0 +1,102 @@
+"""Compare the norms module with the extraction it replaced.
+
+The reference functions are the ones of pdf_reader.py before the norms
+module. Primary norms must be the same strings in the same numeric order,
+only ties within a paragraph may come out differently. Secondary norms
+must be identical.
+"""
+
+import random
+import re
+
+import pytest
+
+from norms import extract_primary_norms, extract_secondary_norms
+
+reference_norms_pattern = r"§.*?\."
+
+
+def reference_custom_sort(norm):
+    match = re.search(r"\d+", norm)
+    if match:
+        return int(match.group())
+    return 0
+
+
+def reference_primary_norms(text_dict):
+    primary_norms = []
+    for key, text in text_dict.items():
+        matches = re.findall(reference_norms_pattern, text[:20])
+        stripped_matches = [match.rstrip(".") for match in matches]
+        primary_norms.extend(stripped_matches)
+        primary_norms = list(set(primary_norms))
+        primary_norms = sorted(primary_norms, key=reference_custom_sort)
+    return primary_norms
+
+
+def reference_secondary_norms(text_list):
+    laws_and_norms = {}
+    current_law_name = None
+    for text in text_list:
+        if "wird wie folgt geändert" in text:
+            law_name_candidate = text.split(" wird wie folgt geändert")[0].strip()
+            current_law_name = re.sub(r"^\s*[IVXLCDM]+\. Das ", "", law_name_candidate)
+        else:
+            norms_list = re.findall(reference_norms_pattern, text)
+            stripped_norms_list = [norm.rstrip(".") for norm in norms_list]
+            if stripped_norms_list and current_law_name:
+                laws_and_norms[current_law_name] = stripped_norms_list
+    return laws_and_norms
+
+
+tokens = [
+    "§",
+    "§§",
+    "§ ",
+    " ",
+    " ",
+    ". ",
+    ".",
+    "1",
+    "3",
+    "12",
+    "14",
+    "120",
+    "a",
+    " a",
+    "b",
+    "bis",
+    " bis ",
+    "ter",
+    " e contrario",
+    "-",
+    "Abs. 2",
+    " lit. b",
+    " und ",
+    "Der Kantonsrat",
+    "Text",
+    "II. Das Steuergesetz",
+    "Gemeindegesetz",
+    " wird wie folgt geändert:",
+]
+
+
+def random_text(rng):
+    return "".join(rng.choice(tokens) for _ in range(rng.randint(0, 25)))
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_matches_reference_extraction(seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        texts = [random_text(rng) for _ in range(rng.randint(0, 8))]
+
+        text_dict = {(0, i): text for i, text in enumerate(texts)}
+        primary = extract_primary_norms(text_dict)
+        reference = reference_primary_norms(text_dict)
+        assert sorted(primary) == sorted(reference)
+        assert [reference_custom_sort(norm) for norm in primary] == [
+            reference_custom_sort(norm) for norm in reference
+        ]
+
+        assert extract_secondary_norms(texts) == reference_secondary_norms(texts)
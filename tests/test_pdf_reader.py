@@ -0,0 +1,72 @@
+import multiprocessing
+import os
+import time
+from datetime import date
+
+import pytest
+
+import pdf_reader
+from dispatch_store import DispatchStore
+from records import Dispatch, Vorlage
+
+pdf_urls = (
+    [f"https://example.org/{name}.pdf" for name in "ab"]
+    + ["https://example.org/crash.pdf"]
+    + [f"https://example.org/{name}.pdf" for name in "cdef"]
+)
+
+
+def fake_process_pdf(pdf_path, keep_report=False):
+    # Runs in the worker process, the crashing PDF takes its process down
+    # while the extractions of the others are still running
+    if "crash" in pdf_path:
+        time.sleep(0.1)
+        os._exit(1)
+    time.sleep(0.5)
+    fields = {
+        "original_pdf_data": [pdf_path],
+        "primary_pdf_data": [],
+        "secondary_pdf_data": [],
+        "primary_norms": ["§ 1"],
+        "secondary_norms": ["Keine Normen gefunden."],
+    }
+    return fields, {"pages": 1, "size": 1, "seconds": 0.5}
+
+
+@pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork",
+    reason="the worker processes must see the patched process_pdf",
+)
+# With few PDFs in flight the later ones are submitted to the broken pool
+@pytest.mark.parametrize("max_in_flight", [16, 2])
+def test_dying_worker_only_fails_its_own_pdf(tmp_path, monkeypatch, max_in_flight):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pdf_reader, "download_pdf", lambda pdf_url, cache: pdf_url)
+    monkeypatch.setattr(pdf_reader, "process_pdf", fake_process_pdf)
+    with DispatchStore() as store:
+        store.add_dispatch(
+            Dispatch(
+                date=date(2024, 2, 1),
+                guid="g1",
+                vorlagen=[
+                    Vorlage(f"Vorlage {i}", "Vorlage", pdf_url, str(5800 + i))
+                    for i, pdf_url in enumerate(pdf_urls)
+                ],
+            )
+        )
+
+    pdf_reader.pdf_reader(extract_workers=3, max_in_flight=max_in_flight)
+
+    with DispatchStore() as store:
+        failures = store.connection.execute(
+            "SELECT pdf_url, attempts FROM failures JOIN vorlagen ON id = vorlage_id"
+        ).fetchall()
+        extracted = [
+            vorlage.pdf_url
+            for dispatch in store.iter_dispatches()
+            for vorlage in dispatch.vorlagen
+            if vorlage.text_key is not None
+        ]
+    crash_url = "https://example.org/crash.pdf"
+    assert [tuple(row) for row in failures] == [(crash_url, 1)]
+    assert sorted(extracted) == sorted(set(pdf_urls) - {crash_url})
@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import search_index
+from search_index import build_index, tokenize
+
+documents = [
+    (
+        {"date": "01.02.2024", "nr": "5800", "title": "Steuergesetz", "pdf": "a.pdf"},
+        "Änderung des Steuergesetzes\n§ 18. Die Einkommenssteuer wird erhoben.",
+    ),
+    (
+        {"date": "02.02.2024", "nr": "5801", "title": "Gemeindegesetz", "pdf": "b.pdf"},
+        "Gemeindegesetz\nDie §§ 14 bis 16 werden aufgehoben, § 3 e contrario.",
+    ),
+    (
+        {"date": "03.02.2024", "nr": "5802", "title": "Archivgesetz", "pdf": "c.pdf"},
+        "Archivgesetz\n§ 14bis. Die Gemeindearchive werden nach kan-\ntonalem Recht "
+        "geführt, § 20 a Abs. 2.",
+    ),
+]
+
+
+def test_tokenize_norms():
+    assert tokenize("§ 12a, §§ 12 a und § 12bis") == ["§12a", "§12a", "§12bis"]
+
+
+def test_tokenize_range_gives_both_ends():
+    assert tokenize("§§ 14 bis 16") == ["§14", "§16"]
+    assert tokenize("§§ 14-16") == ["§14", "§16"]
+    assert tokenize("§§ 14 a bis 16 b") == ["§14a", "§16b"]
+
+
+def test_tokenize_word_after_paragraph_is_no_suffix():
+    assert tokenize("§ 3 e contrario") == ["§3", "contrario"]
+
+
+@pytest.fixture
+def index_directory(tmp_path, monkeypatch):
+    # Few terms per shard, so the queries have to fetch several shards
+    monkeypatch.setattr(search_index, "terms_per_shard", 2)
+    files = build_index(documents)
+    assert json.loads(json.dumps(files["meta.json"]))["shards"] == 16
+    for name, data in files.items():
+        (tmp_path / name).write_text(json.dumps(data, ensure_ascii=False))
+    return tmp_path
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_search_js_queries(index_directory):
+    queries = {
+        "§ 18": ["a.pdf"],
+        "§16": ["b.pdf"],
+        "§ 14": ["b.pdf"],
+        "§ 14bis": ["c.pdf"],
+        "§ 3": ["b.pdf"],
+        "§ 3e": [],
+        "§ 20 a Abs. 2": ["c.pdf"],
+        "Steuergesetz": ["a.pdf"],
+        "Einkommenssteuern": ["a.pdf"],
+        "kantonalem": ["c.pdf"],
+        "gesetz": [],
+        "Gemeindearchive Recht": ["c.pdf"],
+    }
+    output = subprocess.run(
+        [
+            "node",
+            os.path.join(os.path.dirname(__file__), "search_query.js"),
+            str(index_directory),
+            *queries,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=60,
+    )
+    assert json.loads(output.stdout) == queries
@@ -0,0 +1,94 @@
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+
+from pdf_cache import cache_key
+
+# Optional, compresses better and faster than gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Directory holding the extracted text of each PDF
+text_dir = "pdf_text"
+
+# Fields holding the extracted text, kept out of the dispatch records
+text_fields = ["original_pdf_data", "primary_pdf_data", "secondary_pdf_data"]
+
+
+def text_key(pdf_url):
+    # The text belongs to the PDF, vorlagen sharing a PDF share its text
+    edoc_id, version = cache_key(pdf_url)
+    return re.sub(r"[^\w.-]", "_", f"{edoc_id}_{version}")
+
+
+class TextStore:
+    """Compressed text extracted from each PDF, one file per text key.
+
+    Files are zstd-compressed if zstandard is installed and gzip-compressed
+    otherwise, both can be read back as long as the codec is available.
+    """
+
+    def __init__(self, directory=text_dir):
+        self.directory = directory
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, f"{key}.json.{suffix}")
+
+    def put(self, key, fields):
+        """Store the text fields of a PDF under key."""
+        data = json.dumps(
+            {field: fields.get(field) for field in text_fields}, ensure_ascii=False
+        ).encode("utf-8")
+        if zstandard is not None:
+            suffix = "zst"
+            data = zstandard.ZstdCompressor(level=10).compress(data)
+        else:
+            suffix = "gz"
+            # A fixed mtime keeps the file identical for identical text
+            data = gzip.compress(data, compresslevel=9, mtime=0)
+
+        # Write to a temporary file first so readers never see partial text
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path(key, suffix))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        # Drop a copy written with the other codec
+        for other in ["zst", "gz"]:
+            if other != suffix:
+                try:
+                    os.unlink(self.path(key, other))
+                except FileNotFoundError:
+                    pass
+
+    def get(self, key):
+        """Return the text fields stored under key, None if there are none."""
+        try:
+            with open(self.path(key, "zst"), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            pass
+        else:
+            if zstandard is None:
+                logging.error(f"zstandard is not installed, cannot read text of {key}")
+                return None
+            return json.loads(zstandard.ZstdDecompressor().decompress(data))
+
+        try:
+            with gzip.open(self.path(key, "gz"), "rb") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None